@@ -0,0 +1,161 @@
+'''
+Non-interactive batch runs of wrapper.py over many workbooks.
+
+Each workbook is read with read_excel, matched and written out as
+<name>_Placements.csv / <name>_Placements_Log.txt in the output directory.
+Workbooks are processed concurrently in a process pool, and a manifest
+with the timings, stability check and any failure of every input is
+written alongside.
+
+    python batch.py "cohorts/*.xlsx" --ranktype rotation --out-dir results \
+        --column prefs_col_end=7
+'''
+from core import *
+from wrapper import run_to_file, write_placements
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import argparse
+import glob
+import inspect
+import os
+import time
+import traceback
+
+READ_EXCEL_COLUMNS = [name for name in inspect.signature(read_excel).parameters
+                      if name.endswith('_col') or '_col_' in name]
+
+
+def expand_inputs(patterns):
+    '''Expand paths and glob patterns into a sorted list of distinct files.'''
+    paths = []
+    for pattern in patterns:
+        matches = glob.glob(pattern) or [pattern]
+        paths.extend(matches)
+    return sorted(set(paths))
+
+
+def output_paths(inputs, out_dir):
+    '''Map each input to its output stem, numbering inputs that would
+    otherwise share a file name.
+    '''
+    stems = {}
+    seen = {}
+    for fp in inputs:
+        stem = os.path.splitext(os.path.basename(fp))[0]
+        seen[stem] = seen.get(stem, 0) + 1
+        if seen[stem] > 1:
+            stem = '{}_{}'.format(stem, seen[stem])
+        stems[fp] = os.path.join(out_dir, stem)
+    return stems
+
+
+def run_workbook(fp, stem, analyst_sheet, team_sheet, columns, ranktype,
+                 engine, log_level, objective='rank', snapshot=False):
+    '''Read, match and write out one workbook. Never raises; failures are
+    reported in the returned manifest row. With snapshot, the schema and
+    run are also saved with save_snapshot.
+    '''
+    row = {'Input': fp, 'Placements': stem + '_Placements.csv',
+           'Log': stem + '_Placements_Log.txt', 'Status': 'ok', 'Error': None}
+    if snapshot:
+        row['Snapshot'] = stem + '_Snapshot'
+    start = time.perf_counter()
+    try:
+        schema = read_excel(fp, analyst_sheet, team_sheet, **columns)
+        row['Analysts'] = schema.n_analysts
+        row['Teams'] = schema.n_teams
+        read_done = time.perf_counter()
+        run = run_to_file(schema, ranktype, row['Log'], keep_log=snapshot,
+                          engine=engine, log_level=log_level,
+                          objective=objective)
+        match_done = time.perf_counter()
+        write_placements(run, row['Placements'])
+        if snapshot:
+            save_snapshot(row['Snapshot'], schema, run)
+        write_done = time.perf_counter()
+        stability = run.verify()
+        row['Stable'] = stability['Stable']
+        row['Blocking Pairs'] = len(stability['Blocking Pairs'])
+        row['Read Seconds'] = read_done - start
+        #The log is written while matching, so it is part of this time.
+        row['Match Seconds'] = match_done - read_done
+        row['Write Seconds'] = write_done - match_done
+        row['Verify Seconds'] = time.perf_counter() - write_done
+    except Exception as e:
+        row['Status'] = 'failed'
+        row['Error'] = '{}: {}'.format(type(e).__name__, e)
+        row['Traceback'] = traceback.format_exc()
+    row['Total Seconds'] = time.perf_counter() - start
+    return row
+
+
+def run_batch(inputs, out_dir='.', analyst_sheet=0, team_sheet=1, columns=None,
+              ranktype='rotation', engine='rounds', log_level=LOG_ITERATION,
+              workers=None, objective='rank', snapshot=False):
+    '''Process every workbook and return the manifest as a DataFrame, in the
+    order the inputs were given.
+    '''
+    columns = columns or {}
+    os.makedirs(out_dir, exist_ok=True)
+    stems = output_paths(inputs, out_dir)
+    args = (analyst_sheet, team_sheet, columns, ranktype, engine, log_level,
+            objective, snapshot)
+    rows = {}
+    with ProcessPoolExecutor(workers) as pool:
+        futures = {pool.submit(run_workbook, fp, stems[fp], *args): fp
+                   for fp in inputs}
+        for future in as_completed(futures):
+            row = future.result()
+            rows[futures[future]] = row
+            print('{Status:>6}  {Input}  ({Total Seconds:.2f}s)'.format(**row))
+    return pd.DataFrame([rows[fp] for fp in inputs])
+
+
+def sheet(value):
+    '''Sheets can be given by index or by name.'''
+    return int(value) if value.isdigit() else value
+
+
+def column(value):
+    key, _, index = value.partition('=')
+    if key not in READ_EXCEL_COLUMNS or not index.isdigit():
+        choices = ', '.join(READ_EXCEL_COLUMNS)
+        raise argparse.ArgumentTypeError(f'Expected KEY=INDEX with KEY one of: {choices}')
+    return key, int(index)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run placements for many workbooks.')
+    parser.add_argument('inputs', nargs='+', help='Workbook paths or glob patterns.')
+    parser.add_argument('--analyst-sheet', type=sheet, default=0)
+    parser.add_argument('--team-sheet', type=sheet, default=1)
+    parser.add_argument('--column', type=column, action='append', default=[],
+                        help='Column mapping for read_excel, e.g. prefs_col_end=7.')
+    parser.add_argument('--ranktype', default='rotation', choices=RANK_TYPES)
+    parser.add_argument('--engine', default='rounds', choices=ENGINES)
+    parser.add_argument('--objective', default='rank', choices=OBJECTIVES,
+                        help="What the 'optimal' engine minimizes.")
+    parser.add_argument('--log-level', type=int, default=LOG_ITERATION,
+                        choices=[LOG_OFF, LOG_SUMMARY, LOG_ITERATION, LOG_PROPOSAL])
+    parser.add_argument('--snapshot', action='store_true',
+                        help='Also save each match as a reloadable snapshot.')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--out-dir', default='.')
+    parser.add_argument('--manifest', default=None,
+                        help='Defaults to <out-dir>/Upward_Manifest.csv.')
+    args = parser.parse_args(argv)
+
+    inputs = expand_inputs(args.inputs)
+    manifest = run_batch(inputs, args.out_dir, args.analyst_sheet,
+                         args.team_sheet, dict(args.column), args.ranktype,
+                         args.engine, args.log_level, args.workers,
+                         args.objective, args.snapshot)
+    manifest_fp = args.manifest or os.path.join(args.out_dir, 'Upward_Manifest.csv')
+    manifest.to_csv(manifest_fp, index=False)
+    n_failed = (manifest['Status'] != 'ok').sum()
+    print('{} workbooks, {} failed. Manifest: {}'.format(len(manifest), n_failed,
+                                                        manifest_fp))
+    return 1 if n_failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,172 @@
+'''
+Scaling benchmark for Schema.run.
+
+Generates random cohorts with random_schema over a grid of sizes and
+records, for every rank type and engine, the wall time, peak memory and
+run statistics (counts and per-phase timings) of one placement run.
+Results are written as JSON so runs from different commits can be
+compared with --compare.
+
+    python benchmark.py --analysts 10 100 1000 --teams 5 15 --out bench.json
+    python benchmark.py --compare old.json new.json
+'''
+from core import *
+import argparse
+import itertools
+import json
+import platform
+import subprocess
+import sys
+import time
+
+DEFAULT_ANALYSTS = [10, 100, 1000, 10000, 100000]
+DEFAULT_TEAMS = [5, 15]
+DEFAULT_EXTRA = [0, 10]
+
+
+def git_commit():
+    try:
+        output = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                                capture_output=True, text=True, check=True)
+        return output.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_case(n_analysts, n_teams, extra_spots, ranktype, engine, memory=True,
+             verify=True, seed=None):
+    '''Time one placement run on a fresh random cohort, generated (and its
+    ties broken) from seed. Schema generation is not included in the
+    timings. With verify, the placements are also checked for stability
+    (timed separately).
+    '''
+    schema = random_schema(n_analysts, n_teams, extra_spots, seed=seed)
+    profile = profile_memory if memory else None
+    start = time.perf_counter()
+    run = schema.run(ranktype, engine=engine, log_level=LOG_OFF, seed=seed,
+                     profile=profile)
+    seconds = time.perf_counter() - start
+    result = {'Seconds': seconds, 'Peak Bytes': None,
+              'Tiebreakers': run.random_tbs}
+    result.update(run.stats)
+    if verify:
+        start = time.perf_counter()
+        stability = run.verify()
+        result['Verify Seconds'] = time.perf_counter() - start
+        result['Blocking Pairs'] = len(stability['Blocking Pairs'])
+        result['Stable'] = stability['Stable']
+    return result
+
+
+def case_seed(seed, n_analysts, n_teams, extra_spots, repeat):
+    '''The seed of one grid point and repeat. It depends only on the cohort,
+    so every rank type and engine, and both sides of --compare, time the
+    same cohorts.
+    '''
+    key = (n_analysts, n_teams, extra_spots, repeat)
+    return int(np.random.SeedSequence(seed, spawn_key=key).generate_state(1)[0])
+
+
+def run_grid(analysts, teams, extras, ranktypes, engines, repeat=1,
+             max_seconds=None, memory=True, verify=True, seed=0):
+    '''Run every grid point, yielding one result row at a time. Sizes are run
+    smallest first; once a (ranktype, engine, teams, extra) series takes
+    longer than max_seconds, its larger sizes are skipped.
+    '''
+    series = itertools.product(ranktypes, engines, teams, extras)
+    for ranktype, engine, n_teams, extra_spots in series:
+        too_slow = False
+        for n_analysts in sorted(analysts):
+            for i in range(repeat):
+                row = {'Analysts': n_analysts, 'Teams': n_teams,
+                       'Extra': extra_spots, 'Rank Type': ranktype,
+                       'Engine': engine, 'Repeat': i,
+                       'Seed': case_seed(seed, n_analysts, n_teams,
+                                         extra_spots, i)}
+                if too_slow:
+                    row['Skipped'] = True
+                    yield row
+                    continue
+                try:
+                    row.update(run_case(n_analysts, n_teams, extra_spots,
+                                        ranktype, engine, memory, verify,
+                                        row['Seed']))
+                except Exception as e:
+                    row['Error'] = '{}: {}'.format(type(e).__name__, e)
+                yield row
+                if max_seconds and row.get('Seconds', 0) > max_seconds:
+                    too_slow = True
+
+
+def case_id(row):
+    return (row['Analysts'], row['Teams'], row['Extra'], row['Rank Type'],
+            row['Engine'])
+
+
+def compare(old_fp, new_fp):
+    '''Print the new/old wall time ratio of every grid point in both files.'''
+    with open(old_fp) as file:
+        old = json.load(file)
+    with open(new_fp) as file:
+        new = json.load(file)
+    old_times = {}
+    for row in old['Results']:
+        if 'Seconds' in row:
+            old_times.setdefault(case_id(row), []).append(row['Seconds'])
+    new_times = {}
+    for row in new['Results']:
+        if 'Seconds' in row:
+            new_times.setdefault(case_id(row), []).append(row['Seconds'])
+    print('{} ({}) -> {} ({})'.format(old_fp, old['Commit'], new_fp, new['Commit']))
+    template = '{:>8} {:>5} {:>5} {:>9} {:>6} {:>10} {:>10} {:>7}'
+    print(template.format('Analysts', 'Teams', 'Extra', 'Rank Type', 'Engine',
+                          'Old (s)', 'New (s)', 'Ratio'))
+    for key in sorted(set(old_times) & set(new_times)):
+        old_s = min(old_times[key])
+        new_s = min(new_times[key])
+        ratio = new_s / old_s if old_s else float('inf')
+        print(template.format(*key, '{:.4f}'.format(old_s),
+                              '{:.4f}'.format(new_s), '{:.2f}'.format(ratio)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--analysts', type=int, nargs='+', default=DEFAULT_ANALYSTS)
+    parser.add_argument('--teams', type=int, nargs='+', default=DEFAULT_TEAMS)
+    parser.add_argument('--extra', type=int, nargs='+', default=DEFAULT_EXTRA)
+    parser.add_argument('--ranktypes', nargs='+', default=list(RANK_TYPES),
+                        choices=RANK_TYPES)
+    parser.add_argument('--engines', nargs='+', default=list(ENGINES),
+                        choices=ENGINES)
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--max-seconds', type=float, default=60,
+                        help='Skip larger cohorts once a run takes this long.')
+    parser.add_argument('--no-memory', action='store_true',
+                        help='Skip tracemalloc, which slows runs down.')
+    parser.add_argument('--no-verify', action='store_true',
+                        help='Skip the stability check of each run.')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seeds the cohorts; compare runs with the same seed.')
+    parser.add_argument('--out', default='bench_output.json')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    results = []
+    grid = run_grid(args.analysts, args.teams, args.extra, args.ranktypes,
+                    args.engines, args.repeat, args.max_seconds,
+                    not args.no_memory, not args.no_verify, args.seed)
+    for row in grid:
+        results.append(row)
+        print(json.dumps(row), file=sys.stderr)
+    report = {'Commit': git_commit(), 'Python': platform.python_version(),
+              'Results': results}
+    with open(args.out, 'w') as file:
+        json.dump(report, file, indent=1)
+
+
+if __name__ == '__main__':
+    main()
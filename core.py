@@ -1,8 +1,34 @@
 from nltk.corpus import names
+import numpy as np
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+import cProfile
+import functools
+import heapq
+import json
+import os
+import pstats
 import random
+import time
+import tracemalloc
+
+RANK_TYPES = ('fulltime', 'rotation')
+ENGINES = ('rounds', 'heap', 'optimal')
+OBJECTIVES = ('rank', 'rating')
+TIEBREAKS = ('pairwise', 'single', 'multiple')
+UNRANKED = np.iinfo(np.int16).max #Analyst did not list the team.
+UNRATED = np.iinfo(np.int32).max #Team did not rate the analyst.
+NO_PRIORITY = np.iinfo(np.int64).max #Analyst can never be placed on the team.
+
+#Event log verbosity levels.
+LOG_OFF = 0
+LOG_SUMMARY = 1
+LOG_ITERATION = 2
+LOG_PROPOSAL = 3
 
 class Analyst:
+    __slots__ = ('name', 'clas', 'perf', 'prefs', 'inv_prefs')
 
     def __init__(self, name, clas, perf, prefs):
         '''
@@ -19,12 +45,51 @@ class Analyst:
         self.perf = perf
         self.prefs = prefs
         self.inv_prefs = {v:k for k, v in self.prefs.items()}
-        self.prefs_exhausted = 0
 
     def __repr__(self):
         return self.name
 
+class AnalystView(Analyst):
+    '''An Analyst backed by one row of a CompactSchema. Nothing but the
+    row id is stored per analyst; attributes are read from the arrays.
+    '''
+    __slots__ = ('compact', 'id')
+
+    def __init__(self, compact, id):
+        self.compact = compact
+        self.id = id
+
+    def __reduce__(self):
+        #The inherited Analyst slots are shadowed by read-only properties,
+        #so pickle the view as the row it points at.
+        return (AnalystView, (self.compact, self.id))
+
+    @property
+    def name(self):
+        return self.compact.analyst_names[self.id]
+
+    @property
+    def clas(self):
+        return int(self.compact.clas[self.id])
+
+    @property
+    def perf(self):
+        return int(self.compact.perf[self.id])
+
+    @property
+    def prefs(self):
+        row = self.compact.prefs[self.id]
+        team_names = self.compact.team_names
+        return {team_names[t]: int(row[t]) for t in np.flatnonzero(row != UNRANKED)}
+
+    @property
+    def inv_prefs(self):
+        row = self.compact.choices('rotation')[self.id]
+        team_names = self.compact.team_names
+        return {i: team_names[t] for i, t in enumerate(row[row >= 0])}
+
 class Team:
+    __slots__ = ('name', 'headcount', 'ratings')
 
     def __init__(self, name, headcount, ratings=None):
         '''
@@ -38,6 +103,633 @@ class Team:
     def __repr__(self):
         return self.name
 
+class TeamView(Team):
+    '''A Team backed by one row of a CompactSchema.'''
+    __slots__ = ('compact', 'id')
+
+    def __init__(self, compact, id):
+        self.compact = compact
+        self.id = id
+
+    def __reduce__(self):
+        return (TeamView, (self.compact, self.id))
+
+    @property
+    def name(self):
+        return self.compact.team_names[self.id]
+
+    @property
+    def headcount(self):
+        return int(self.compact.headcount[self.id])
+
+    @property
+    def ratings(self):
+        if not self.compact.has_ratings:
+            return None
+        row = self.compact.ratings[self.id]
+        analyst_names = self.compact.analyst_names
+        return {analyst_names[a]: int(row[a]) for a in np.flatnonzero(row != UNRATED)}
+
+def dense_rank(values):
+    '''Map values onto 0..n-1 preserving order and ties. Returns the ranks
+    (same shape as values) and n.
+    '''
+    uniq, inverse = np.unique(values, return_inverse=True)
+    return inverse.reshape(np.shape(values)).astype(np.int64), len(uniq)
+
+class CompactSchema:
+    '''
+    Columnar form of a Schema. Analyst and team names are interned to
+    integer ids (their position in analyst_names/team_names) and everything
+    else is stored in arrays indexed by those ids:
+
+    prefs: (int16, analysts x teams) the analyst's rank of the team, or
+        UNRANKED.
+    ratings: (int32, teams x analysts) the team's rating of the analyst, or
+        UNRATED.
+    clas, perf, headcount: (int32) per analyst / per team.
+
+    The matching engines run on these ids, and the per-rank-type proposal
+    orders and precedence keys are computed once, in bulk, and cached.
+    '''
+    __slots__ = ('analyst_names', 'team_names', 'analyst_ids', 'team_ids',
+                 'clas', 'perf', 'prefs', 'ratings', 'headcount',
+                 'has_ratings', '_choices', '_choice_ranks', '_priority')
+
+    def __init__(self, analyst_names, team_names, clas, perf, prefs,
+                 headcount, ratings=None):
+        self.analyst_names = list(analyst_names)
+        self.team_names = list(team_names)
+        self.analyst_ids = {name: i for i, name in enumerate(self.analyst_names)}
+        self.team_ids = {name: i for i, name in enumerate(self.team_names)}
+        self.clas = np.asarray(clas, dtype=np.int32)
+        self.perf = np.asarray(perf, dtype=np.int32)
+        self.prefs = np.asarray(prefs, dtype=np.int16)
+        self.headcount = np.asarray(headcount, dtype=np.int32)
+        self.has_ratings = ratings is not None
+        if ratings is None:
+            ratings = np.full((self.n_teams, self.n_analysts), UNRATED)
+        self.ratings = np.asarray(ratings, dtype=np.int32)
+        assert self.prefs.shape == (self.n_analysts, self.n_teams)
+        assert self.ratings.shape == (self.n_teams, self.n_analysts)
+        self._choices = {}
+        self._choice_ranks = {}
+        self._priority = {}
+
+    @property
+    def n_analysts(self):
+        return len(self.analyst_names)
+
+    @property
+    def n_teams(self):
+        return len(self.team_names)
+
+    @classmethod
+    def from_objects(cls, analysts, teams):
+        '''Build the arrays from lists of Analyst and Team objects.
+        Preferences for unknown teams and ratings of unknown analysts are
+        ignored.
+        '''
+        analyst_names = [analyst.name for analyst in analysts]
+        team_names = [team.name for team in teams]
+        analyst_ids = {name: i for i, name in enumerate(analyst_names)}
+        team_ids = {name: i for i, name in enumerate(team_names)}
+        prefs = np.full((len(analysts), len(teams)), UNRANKED, dtype=np.int16)
+        for a, analyst in enumerate(analysts):
+            for team_name, pref in analyst.prefs.items():
+                t = team_ids.get(team_name)
+                if t is not None:
+                    prefs[a, t] = pref
+        ratings = None
+        if any(team.ratings for team in teams):
+            ratings = np.full((len(teams), len(analysts)), UNRATED, dtype=np.int32)
+            for t, team in enumerate(teams):
+                for analyst_name, rating in (team.ratings or {}).items():
+                    a = analyst_ids.get(analyst_name)
+                    if a is not None:
+                        ratings[t, a] = rating
+        return cls(analyst_names, team_names,
+                   [analyst.clas for analyst in analysts],
+                   [analyst.perf for analyst in analysts],
+                   prefs, [team.headcount for team in teams], ratings)
+
+    def choices(self, rank_type):
+        '''(analysts x teams) team ids in the order each analyst proposes
+        to them, padded with -1. For rotation this is the analyst's own
+        preference order; for fulltime, teams that rated the analyst ordered
+        by rating and then preference.
+        '''
+        assert rank_type in RANK_TYPES
+        if rank_type not in self._choices:
+            if rank_type == 'rotation':
+                valid = self.prefs != UNRANKED
+                order = np.argsort(self.prefs, axis=1, kind='stable')
+            else:
+                valid = (self.prefs != UNRANKED) & (self.ratings.T != UNRATED)
+                primary = np.where(valid, self.ratings.T, UNRATED)
+                order = np.lexsort((self.prefs, primary), axis=-1)
+            valid = np.take_along_axis(valid, order, axis=1)
+            self._choices[rank_type] = np.where(valid, order, -1).astype(np.int32)
+        return self._choices[rank_type]
+
+    def choice_ranks(self, rank_type):
+        '''(analysts x teams) the position of each team in the analyst's
+        proposal order, or n_teams if the analyst never proposes to it.
+        '''
+        if rank_type not in self._choice_ranks:
+            choices = self.choices(rank_type)
+            ranks = np.full(choices.shape, self.n_teams, dtype=np.int32)
+            rows, positions = np.nonzero(choices >= 0)
+            ranks[rows, choices[rows, positions]] = positions
+            self._choice_ranks[rank_type] = ranks
+        return self._choice_ranks[rank_type]
+
+    def subset(self, analyst_ids, headcount=None):
+        '''
+        A CompactSchema of only the given analysts (ids in this one), with
+        the same teams and team ids, and headcount if given. Proposal orders
+        and precedence keys already computed here are sliced rather than
+        recomputed: both are per analyst row (or column), and the sliced
+        keys still order the analysts exactly as before.
+        '''
+        ids = np.asarray(analyst_ids, dtype=np.int64)
+        sub = CompactSchema([self.analyst_names[i] for i in ids],
+                            self.team_names, self.clas[ids], self.perf[ids],
+                            self.prefs[ids],
+                            self.headcount if headcount is None else headcount,
+                            self.ratings[:, ids] if self.has_ratings else None)
+        for rank_type, choices in self._choices.items():
+            sub._choices[rank_type] = choices[ids]
+        for rank_type, ranks in self._choice_ranks.items():
+            sub._choice_ranks[rank_type] = ranks[ids]
+        for rank_type, priority in self._priority.items():
+            sub._priority[rank_type] = priority[:, ids]
+        return sub
+
+    def edit(self, edits):
+        '''
+        Apply edits (see Schema.rematch) and return a new CompactSchema,
+        along with the id each of its analysts had in this one (-1 if
+        added). Removals and additions are applied first, then the other
+        edits in order.
+        '''
+        def analyst_id(ids, name):
+            if name not in ids:
+                raise ValueError(f'Unknown analyst {name}.')
+            return ids[name]
+
+        def team_id(name):
+            if name not in self.team_ids:
+                raise ValueError(f'Unknown team {name}.')
+            return self.team_ids[name]
+
+        def prefs_row(prefs):
+            row = np.full(self.n_teams, UNRANKED, dtype=np.int16)
+            for team_name, pref in prefs.items():
+                row[team_id(team_name)] = pref
+            return row
+
+        keep = np.ones(self.n_analysts, dtype=bool)
+        added = []
+        for edit in edits:
+            if edit[0] == 'remove':
+                keep[analyst_id(self.analyst_ids, edit[1])] = False
+            elif edit[0] == 'add':
+                analyst = edit[1]
+                if analyst.name in self.analyst_ids and keep[self.analyst_ids[analyst.name]]:
+                    raise ValueError(f'Analyst {analyst.name} already exists.')
+                added.append(analyst)
+            elif edit[0] not in ('prefs', 'headcount', 'rating'):
+                raise ValueError(f'Unknown edit {edit[0]}.')
+        old_ids = np.flatnonzero(keep)
+
+        analyst_names = [self.analyst_names[a] for a in old_ids]
+        analyst_names += [analyst.name for analyst in added]
+        add_prefs = np.array([prefs_row(analyst.prefs) for analyst in added],
+                             dtype=np.int16).reshape(len(added), self.n_teams)
+        add_ratings = np.full((self.n_teams, len(added)), UNRATED, dtype=np.int32)
+        has_ratings = self.has_ratings or any(edit[0] == 'rating' for edit in edits)
+        compact = CompactSchema(
+            analyst_names, self.team_names,
+            np.concatenate([self.clas[keep], [analyst.clas for analyst in added]]),
+            np.concatenate([self.perf[keep], [analyst.perf for analyst in added]]),
+            np.concatenate([self.prefs[keep], add_prefs]),
+            self.headcount.copy(),
+            np.concatenate([self.ratings[:, keep], add_ratings], axis=1) if has_ratings else None)
+
+        for edit in edits:
+            if edit[0] == 'prefs':
+                compact.prefs[analyst_id(compact.analyst_ids, edit[1])] = prefs_row(edit[2])
+            elif edit[0] == 'headcount':
+                compact.headcount[team_id(edit[1])] = edit[2]
+            elif edit[0] == 'rating':
+                a = analyst_id(compact.analyst_ids, edit[2])
+                compact.ratings[team_id(edit[1]), a] = edit[3]
+        old_ids = np.concatenate([old_ids, np.full(len(added), -1)])
+        return compact, old_ids
+
+    def strict_priority(self, rank_type, lottery):
+        '''(teams x analysts) int32 position of every analyst in each team's
+        strict order: the precedence keys, with lottery (one number per
+        analyst, or teams x analysts for one per team and analyst) breaking
+        ties. Computed for all teams in one sort.
+        '''
+        priority = self.priority(rank_type)
+        lottery = np.broadcast_to(lottery, priority.shape)
+        order = np.lexsort((lottery, priority), axis=-1)
+        positions = np.broadcast_to(np.arange(self.n_analysts, dtype=np.int32),
+                                    priority.shape)
+        strict = np.empty(priority.shape, dtype=np.int32)
+        np.put_along_axis(strict, order, positions, axis=1)
+        return strict
+
+    def priority(self, rank_type):
+        '''(teams x analysts) int64 precedence keys: lower takes precedence
+        and equal keys are ties. Each component of the precedence hierarchy
+        is dense-ranked and packed into one integer, so the keys order
+        analysts exactly like Schema.sort_key. NO_PRIORITY marks analysts
+        who can never be placed on the team.
+        '''
+        assert rank_type in RANK_TYPES
+        if rank_type not in self._priority:
+            perf_rank, n_perf = dense_rank(-self.perf)
+            prefs = self.prefs.T.astype(np.int64)
+            valid = prefs != UNRANKED
+            if rank_type == 'rotation':
+                pref_rank, _ = dense_rank(prefs)
+                clas_rank, n_clas = dense_rank(self.clas)
+                key = (pref_rank * n_clas + clas_rank) * n_perf + perf_rank
+            else:
+                valid &= self.ratings != UNRATED
+                rating_rank, _ = dense_rank(self.ratings)
+                pref_rank, n_pref = dense_rank(-prefs)
+                key = (rating_rank * n_pref + pref_rank) * n_perf + perf_rank
+            self._priority[rank_type] = np.where(valid, key, NO_PRIORITY)
+        return self._priority[rank_type]
+
+class EventLog:
+    '''
+    Append-only, structured log of how the algorithm behaved.
+
+    Events are (level, kind, data) tuples recording deltas (who was rejected
+    from where, who moved where) rather than snapshots of the placements.
+    Nothing is formatted until render() or json() is called, and events
+    above the log's level are dropped, so callers on the hot path should
+    check enabled() before building an event's data.
+
+    level: (int) LOG_OFF, LOG_SUMMARY (start and convergence),
+        LOG_ITERATION (plus rejections per iteration and pairwise
+        tiebreaks) or
+        LOG_PROPOSAL (plus every single proposal).
+    noisy: (bool) Also print each event as it is recorded.
+    '''
+
+    def __init__(self, level=LOG_ITERATION, noisy=False):
+        self.level = level
+        self.noisy = noisy
+        self.events = []
+
+    def __len__(self):
+        return len(self.events)
+
+    def enabled(self, level):
+        return level <= self.level
+
+    def add(self, level, kind, **data):
+        if level > self.level:
+            return
+        event = (level, kind, data)
+        self.events.append(event)
+        if self.noisy:
+            print(self.render_event(event))
+
+    @staticmethod
+    def render_event(event):
+        '''Render one event as text. (We keep the fun, explanatory notation
+        such as "At last! Convergence.")
+        '''
+        level, kind, data = event
+        if kind == 'start':
+            template = 'Placing {Analysts} analysts on {Teams} teams ({Ranktype}, {Engine} engine).'
+            return template.format(**data)
+        if kind == 'iteration':
+            lines = ['#### Iteration {} ####'.format(data['Iteration'])]
+            for team, analysts in data['Rejected'].items():
+                lines.append('{} rejected: {}'.format(team, ', '.join(analysts)))
+            if data['Unassigned']:
+                lines.append('{} still unassigned.'.format(data['Unassigned']))
+            return '\n'.join(lines)
+        if kind == 'proposal':
+            if data['From'] is None:
+                return '{} proposes to {}'.format(data['Analyst'], data['To'])
+            template = '{} moves from {} to {}'
+            return template.format(data['Analyst'], data['From'], data['To'])
+        if kind == 'tiebreak':
+            template = 'Random tiebreak on {Team}: {Winner} over {Loser}'
+            return template.format(**data)
+        if kind == 'lottery':
+            decided = ', '.join('{} {}'.format(team, n)
+                                for team, n in data['Decided'].items())
+            template = 'Lottery ({Mode}) decided {Total} rejections'
+            return template.format(Total=sum(data['Decided'].values()),
+                                   **data) + (': ' + decided if decided else '.')
+        if kind == 'optimal':
+            template = 'Optimal assignment by {Objective}: total cost {Cost}.'
+            return template.format(**data)
+        if kind == 'converged':
+            template = 'At last! Convergence after {Proposals} proposals'
+            if data['Iterations']:
+                template += ' and {Iterations} iterations'
+            return (template + '.\nTiebreakers Used: {Tiebreakers}').format(**data)
+        return '{}: {}'.format(kind, data)
+
+    def render(self):
+        return '\n'.join(self.render_event(event) for event in self.events)
+
+    def json(self):
+        return [dict(Event=kind, **data) for level, kind, data in self.events]
+
+    def drain(self):
+        '''Remove and return the events recorded so far.'''
+        events = self.events
+        self.events = []
+        return events
+
+class RunStats(dict):
+    '''
+    Counters and timings of one Run, kept as a dict so they serialize as is.
+
+    Iterations: (int) Rounds engine only.
+    Proposals: (int) Including every analyst's first proposal.
+    Comparisons: (int) Precedence comparisons between two analysts. See
+        Run.
+    Estimated Comparisons: (int) Rounds engine only: the comparisons its
+        team sorts take, estimated rather than counted. See Run.
+    Rejections: (dict) {team_name: how many proposals the team rejected}.
+    Phase Seconds: (dict) {phase: wall seconds}. The rounds engine spends
+        them on Preprocessing, Initial Proposals, Sorting, Logging and
+        Reassignment; the heap engine on Preprocessing, Matching and
+        Assembly. Lottery runs add Tie Report.
+    Peak Bytes: (int) Only when the run is profiled with profile_memory.
+    '''
+
+    def __init__(self):
+        super().__init__()
+        self['Iterations'] = 0
+        self['Proposals'] = 0
+        self['Comparisons'] = 0
+        self['Estimated Comparisons'] = 0
+        self['Rejections'] = {}
+        self['Phase Seconds'] = {}
+
+    def add_time(self, phase, seconds):
+        times = self['Phase Seconds']
+        times[phase] = times.get(phase, 0) + seconds
+
+    @contextlib.contextmanager
+    def timed(self, phase):
+        '''Add the wall time of the with block to phase.'''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.perf_counter() - start)
+
+@contextlib.contextmanager
+def profile_cpu(run):
+    '''Profile hook for Run: cProfile the run, leaving the pstats.Stats in
+    run.profile.
+    '''
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        run.profile = pstats.Stats(profiler)
+
+@contextlib.contextmanager
+def profile_memory(run):
+    '''Profile hook for Run: trace allocations with tracemalloc and record
+    the peak in run.stats['Peak Bytes'].
+    '''
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    try:
+        yield
+    finally:
+        run.stats['Peak Bytes'] = tracemalloc.get_traced_memory()[1]
+        if not tracing:
+            tracemalloc.stop()
+
+class Run:
+    '''
+    One placement run over a Schema. The Schema is only read; everything the
+    run changes lives here, so any number of runs (either rank type, any
+    seed) can share one Schema, including from several threads.
+
+    placements: (dict) {team_name: [Analyst]}, once the run has finished.
+    assigned: (int32 array) The team id each analyst was placed on (-1 if
+        unplaced), once the run has finished. results() and summary()
+        tabulate it.
+    prefs_exhausted: (dict) {analyst_name: n}, where n is how many of the
+        analyst's choices rejected them.
+    log: (EventLog) What happened, at the requested level.
+    stats: (RunStats) Counts and phase timings. 'Comparisons' counts
+        precedence comparisons as they are made: one per precedence() call,
+        and in the heap engine one per proposal a full team weighs against
+        its worst candidate. The rounds engine sorts whole teams on their
+        keys instead, and counting the comparisons inside the sort would
+        slow it down many times over, so for every n analysts sort_analysts
+        ranks it adds n * ceil(log2 n), the usual cost of a comparison
+        sort, to 'Estimated Comparisons'.
+    random_tbs, random_tbs_data: The random tiebreaks used, and a report
+        of each.
+    tied_ids: (list) The analyst ids of the winner and loser of every
+        pairwise tiebreak, in order, for results().
+
+    tiebreak: (str) How ties in precedence are broken.
+        'pairwise': a coin flip whenever two tied analysts meet, reported
+            one tiebreak at a time in random_tbs_data.
+        'single': one lottery number per analyst, drawn up front and used
+            as the last component of every team's sort key.
+        'multiple': like 'single', but with a separate lottery per team.
+        With a lottery nothing random happens while matching and the run
+        is reproducible from its seed. Instead of one report per tie,
+        tie_report counts, per team, the analysts it rejected only because
+        they lost the lottery to its last admitted analyst; random_tbs is
+        their total.
+
+    objective: (str) What the 'optimal' engine minimizes. See
+        Schema.place_optimal.
+
+    profile: Hooks wrapped around the run: one or a list of callables
+        taking the run and returning a context manager, like profile_cpu
+        and profile_memory. When the run is streamed, the hooks also see
+        whatever the caller does between events.
+    '''
+
+    def __init__(self, schema, ranktype, engine='rounds',
+                 log_level=LOG_ITERATION, noisy=False, seed=None,
+                 tiebreak='pairwise', profile=None, objective='rank'):
+        assert ranktype in RANK_TYPES, f'Unknown rank type {ranktype}.'
+        assert engine in ENGINES, f'Unknown engine {engine}.'
+        assert tiebreak in TIEBREAKS, f'Unknown tiebreak {tiebreak}.'
+        assert objective in OBJECTIVES, f'Unknown objective {objective}.'
+        self.schema = schema
+        self.ranktype = ranktype
+        self.engine = engine
+        self.tiebreak = tiebreak
+        self.objective = objective
+        self.seed = seed
+        self.log = EventLog(log_level, noisy)
+        self.stats = RunStats()
+        if profile is None:
+            profile = []
+        elif callable(profile):
+            profile = [profile]
+        self.hooks = list(profile)
+        self.profile = None
+        self.random_tbs = 0
+        self.random_tbs_data = []
+        self.tied_ids = []
+        self.tie_report = {}
+        self.rng = random.Random(seed)
+        self.strict = None
+        self.placements = None
+        self.assigned = None
+        self.prefs_exhausted = {}
+
+    def __repr__(self):
+        template = '{} run over {}'
+        return template.format(self.ranktype.capitalize(), self.schema)
+
+    def draw_lottery(self):
+        '''Draw the lottery and build from it the strict (teams x analysts)
+        precedence positions used in place of the precedence keys.
+        '''
+        compact = self.schema.compact()
+        rng = np.random.default_rng(self.seed)
+        if self.tiebreak == 'single':
+            lottery = rng.permutation(compact.n_analysts)
+        else:
+            lottery = rng.random((compact.n_teams, compact.n_analysts))
+        self.strict = compact.strict_priority(self.ranktype, lottery)
+
+    def random_tiebreak(self, analyst_a, analyst_b, team):
+        '''Randomly break a tie between two analysts and record the results.
+        '''
+        shuffle = self.rng.sample([analyst_a, analyst_b], 2)
+        winner, loser = shuffle[0], shuffle[1]
+        self.record_tiebreak(winner, loser, team)
+        return winner
+
+    def record_tiebreak(self, winner, loser, team):
+        '''Record the outcome of a random tiebreak.'''
+        self.random_tbs += 1
+        report = {'Winner': winner, 'Loser': loser,
+                  'Team': team, 'Rank Type': self.ranktype}
+        self.random_tbs_data.append(report)
+        analyst_ids = self.schema.compact().analyst_ids
+        self.tied_ids += (analyst_ids[winner.name], analyst_ids[loser.name])
+        if self.log.enabled(LOG_ITERATION):
+            self.log.add(LOG_ITERATION, 'tiebreak', Winner=winner.name,
+                         Loser=loser.name, Team=team.name)
+
+    @property
+    def log_txt(self):
+        '''The text form of the log.'''
+        return self.log.render()
+
+    def verify(self):
+        '''Check the finished run's placements for stability. See
+        Schema.verify.
+        '''
+        return self.schema.verify(self.placements, self.ranktype)
+
+    def results(self):
+        '''
+        The finished run's placements as a DataFrame with one row per placed
+        analyst, built in bulk from the run's arrays. Rows are grouped by
+        team, in team order, each team's analysts best first. Columns:
+        Analyst, Team, Class, Performance.
+        Preference: The analyst's own rank of the team, 0 for their first
+            choice.
+        Proposals: The team's position in the analyst's proposal order, plus
+            one: in deferred acceptance, how many teams the analyst proposed
+            to before settling, this one included.
+        Tiebreak: Whether a random tiebreak decided between the analyst and
+            a tied analyst. Pairwise, that is every winner and loser of a
+            coin flip. With a lottery, it is the analysts a team rejected
+            only because of the lottery (see tie_report), and the analysts
+            that team kept who were tied with them.
+        '''
+        compact = self.schema.compact()
+        priority = compact.priority(self.ranktype)
+        a = np.flatnonzero(self.assigned >= 0)
+        t = self.assigned[a]
+        tied = np.zeros(compact.n_analysts, dtype=bool)
+        if self.strict is not None:
+            lost_a, lost_t, cutoff = self.schema.lottery_ties(self)
+            tied[lost_a] = True
+            decided = np.bincount(lost_t, minlength=compact.n_teams) > 0
+            tied[a] |= decided[t] & (priority[t, a] == cutoff[t])
+        else:
+            tied[np.asarray(self.tied_ids, dtype=np.int64)] = True
+
+        strict = priority if self.strict is None else self.strict
+        order = np.lexsort((a, strict[t, a], t))
+        a, t = a[order], t[order]
+        return pd.DataFrame({
+            'Analyst': np.array(compact.analyst_names, dtype=object)[a],
+            'Team': np.array(compact.team_names, dtype=object)[t],
+            'Class': compact.clas[a],
+            'Performance': compact.perf[a],
+            'Preference': compact.prefs[a, t],
+            'Proposals': compact.choice_ranks(self.ranktype)[a, t] + 1,
+            'Tiebreak': tied[a],
+        })
+
+    def summary(self, results=None):
+        '''
+        How well the analysts fared, from results() (computed if not given).
+        Returns a dict with:
+        Analysts: (int) How many were placed.
+        First Choice, Top Three: (float) The share placed on their first
+            choice, or one of their first three.
+        Mean Preference: (float) 0 if everyone got their first choice.
+        Preference Shares: (dict) {preference: share of analysts}.
+        Tiebreak Share: (float) The share a random tiebreak was involved for.
+        Teams: (DataFrame) Team, Headcount, Placed, Fill Rate and Mean
+            Preference of every team.
+        '''
+        if results is None:
+            results = self.results()
+        compact = self.schema.compact()
+        preference = results['Preference']
+        teams = results.groupby('Team', sort=False)['Preference'].agg(['size', 'mean'])
+        teams = teams.reindex(compact.team_names)
+        placed = teams['size'].fillna(0).astype(int).to_numpy()
+        teams = pd.DataFrame({
+            'Team': compact.team_names,
+            'Headcount': compact.headcount,
+            'Placed': placed,
+            'Fill Rate': placed / np.maximum(compact.headcount, 1),
+            'Mean Preference': teams['mean'].to_numpy(),
+        })
+        shares = preference.value_counts(normalize=True).sort_index()
+        return {
+            'Analysts': len(results),
+            'First Choice': float((preference == 0).mean()) if len(results) else None,
+            'Top Three': float((preference < 3).mean()) if len(results) else None,
+            'Mean Preference': float(preference.mean()) if len(results) else None,
+            'Preference Shares': {int(k): float(v) for k, v in shares.items()},
+            'Tiebreak Share': float(results['Tiebreak'].mean()) if len(results) else None,
+            'Teams': teams,
+        }
+
 class Schema:
 
     def __init__(self, analysts, teams):
@@ -55,17 +747,42 @@ class Schema:
         self.total_hc = 0
         for team in self.teams:
             self.total_hc += team.headcount
+        self._sort_keys = {}
+        self._compact = None
+        self._fulltime_prefs = None
+        #Results of the latest set_placements call, for older callers.
         self.placements = None
         self.random_tbs = 0
         self.random_tbs_data = []
-        self.log = {}
-        self.log_txt = ''
+        self.stats = {}
+        self.log = EventLog(LOG_OFF)
 
     def __repr__(self):
         template = 'Schema with {} analysts, {} teams, and {} headcount'
         message = template.format(self.n_teams, self.n_teams, self.total_hc)
         return message
 
+    @classmethod
+    def from_compact(cls, compact):
+        '''Build a Schema directly from a CompactSchema. The analysts and
+        teams are lightweight views over its arrays.
+        '''
+        analysts = [AnalystView(compact, i) for i in range(compact.n_analysts)]
+        teams = [TeamView(compact, i) for i in range(compact.n_teams)]
+        schema = cls(analysts, teams)
+        schema._compact = compact
+        return schema
+
+    def compact(self):
+        '''Return (building once) the CompactSchema for this Schema. The
+        Schema is treated as read-only from then on. Like the other caches
+        here, two threads may both build it on first use; they build the
+        same thing, so concurrent runs are still safe.
+        '''
+        if self._compact is None:
+            self._compact = CompactSchema.from_objects(self.analysts, self.teams)
+        return self._compact
+
     def json(self):
         meta = {'Analysts':{}, 'Teams': {}}
         for team in self.teams:
@@ -82,237 +799,1193 @@ class Schema:
             meta['Analysts'][analyst.name] = analyst_dict
         return meta
 
-    def random_tiebreak(self, analyst_a, analyst_b, team, rank_type):
-        '''Randomly break a tie between two analysts and record the results.
-        '''
-        shuffle = random.sample([analyst_a, analyst_b], 2)
-        winner, loser = shuffle[0], shuffle[1]
-        self.random_tbs += 1
-        report = {'Winner': winner, 'Loser': loser,
-                  'Team': team, 'Rank Type': rank_type}
-        self.random_tbs_data.append(report)
-        return winner
+    @property
+    def log_txt(self):
+        '''The text form of the latest set_placements log.'''
+        return self.log.render()
 
-    def record(self, text, noisy=True):
+    def sort_key(self, analyst, team, rank_type):
+        '''Return the key that orders an analyst on a team under the
+        precedence hierarchy. Lower keys take precedence.
+        fulltime: team rating, then analyst preference (higher wins), then
+            performance.
+        rotation: analyst preference, then class, then performance.
         '''
-        Function for logging algorithm behavior in text.
-        (This is now logged in JSON, but we keep the text logging for fun,
-        expanatory notation such as "At last! Convergence."
+        if rank_type == 'fulltime':
+            return (team.ratings[analyst.name], -analyst.prefs[team.name],
+                    -analyst.perf)
+        return (analyst.prefs[team.name], analyst.clas, -analyst.perf)
+
+    def sort_keys(self, rank_type):
+        '''Build (once per rank type) the sort key of every analyst on every
+        team they could be placed on, as {team_name: {analyst_name: key}}.
+        Keys are the CompactSchema priorities, which order analysts exactly
+        like sort_key. Analysts without a preference (or, for fulltime, a
+        rating) for a team never propose to it, so they get no key there.
         '''
-        if noisy:
-            print(text)
-        self.log_txt += '\n'
-        self.log_txt += str(text)
+        assert rank_type in RANK_TYPES
+        if rank_type in self._sort_keys:
+            return self._sort_keys[rank_type]
+        compact = self.compact()
+        priority = compact.priority(rank_type)
+        analyst_names = compact.analyst_names
+        keys = {}
+        for t, team_name in enumerate(compact.team_names):
+            row = priority[t]
+            valid = np.flatnonzero(row != NO_PRIORITY)
+            keys[team_name] = dict(zip([analyst_names[a] for a in valid],
+                                       row[valid].tolist()))
+        self._sort_keys[rank_type] = keys
+        return keys
 
-    def precedence(self, analyst_a, analyst_b, team, rank_type):
+    def precedence(self, analyst_a, analyst_b, team, rank_type, run=None):
         '''Given two analysts, a team, and a "rank_type", determine which analyst
         should receive precedence over the other on that team.
         analyst_a: (Analyst)
         analyst_b: (Analyst)
+        run: (Run) Where to count the comparison and record any random
+            tiebreak. Without one, ties are a plain coin flip.
         '''
         assert isinstance(analyst_a, Analyst)
         assert isinstance(analyst_b, Analyst)
         assert isinstance(team, Team)
-        accepted_rank_types = ['fulltime', 'rotation']
-        assert rank_type in accepted_rank_types
+        assert rank_type in RANK_TYPES
 
-        a_class, b_class = analyst_a.clas, analyst_b.clas
-        a_perf, b_perf = analyst_a.perf, analyst_b.perf
-        a_pref, b_pref = analyst_a.prefs[team.name], analyst_b.prefs[team.name]
-        if rank_type == 'fulltime':
-            a_rating, b_rating = team.ratings[analyst_a.name], team.ratings[analyst_b.name]
+        if run is not None and run.strict is not None:
+            ids = self.compact().analyst_ids
+            strict = run.strict[self.compact().team_ids[team.name]]
+            a_key, b_key = strict[ids[analyst_a.name]], strict[ids[analyst_b.name]]
+        else:
+            a_key = self.sort_key(analyst_a, team, rank_type)
+            b_key = self.sort_key(analyst_b, team, rank_type)
+        if run is not None:
+            run.stats['Comparisons'] += 1
+        if a_key < b_key:
+            return analyst_a
+        elif b_key < a_key:
+            return analyst_b
+        elif run is not None:
+            return run.random_tiebreak(analyst_a, analyst_b, team)
+        else:
+            return random.choice([analyst_a, analyst_b])
 
-        if rank_type == 'fulltime':
-            if a_rating < b_rating:
-                return analyst_a
-            elif b_rating < a_rating:
-                return analyst_b
-            #Now that rating is discrete, this never happens:
-            else:
-                if a_pref > b_pref:
-                    return analyst_a
-                elif b_pref > a_pref:
-                    return analyst_b
-                else:
-                    if a_perf > b_perf:
-                        return analyst_a
-                    elif b_perf > a_perf:
-                        return analyst_b
-                    else:
-                        return self.random_tiebreak(analyst_a, analyst_b,
-                                                    team, rank_type)
-        elif rank_type == 'rotation':
-            if a_pref < b_pref:
-                return analyst_a
-            elif b_pref < a_pref:
-                return analyst_b
-            else:
-                if a_class < b_class:
-                    return analyst_a
-                elif b_class < a_class:
-                    return analyst_b
-                else:
-                    if a_perf > b_perf:
-                        return analyst_a
-                    elif b_perf > a_perf:
-                        return analyst_b
-                    else:
-                        return self.random_tiebreak(analyst_a, analyst_b,
-                                                    team, rank_type)
-
-    def sort_analysts(self, analysts, team, ranktype):
-        '''
-        Sorts the analysts based on the precedence hierarchy.
-        (Selection sort.)
-        '''
-        sorted_analysts = []
-        unsorted_analysts = analysts
-        for i in range(len(analysts)):
-            top_analyst = unsorted_analysts[0]
-            for analyst in unsorted_analysts[1:]:
-                if self.precedence(analyst, top_analyst, team, ranktype) == analyst:
-                    top_analyst = analyst
-            sorted_analysts.append(unsorted_analysts.pop(unsorted_analysts.index(top_analyst)))
+    def sort_analysts(self, analysts, team, ranktype, run=None):
+        '''
+        Sorts the analysts based on the precedence hierarchy, using the
+        precomputed sort keys. Runs of analysts with identical keys are
+        shuffled, recording one random tiebreak per adjacent pair on run.
+        If run has drawn a lottery, its strict positions are used instead
+        and there are no ties.
+        '''
+        rng = random if run is None else run.rng
+        if run is not None:
+            n = len(analysts)
+            run.stats['Estimated Comparisons'] += n * (n - 1).bit_length()
+            if run.strict is not None:
+                compact = self.compact()
+                strict = run.strict[compact.team_ids[team.name]]
+                ids = [compact.analyst_ids[analyst.name] for analyst in analysts]
+                return [analysts[i] for i in np.argsort(strict[ids], kind='stable')]
+        keys = self.sort_keys(ranktype)[team.name]
+        sorted_analysts = sorted(analysts, key=lambda analyst: keys[analyst.name])
+        start = 0
+        while start < len(sorted_analysts):
+            key = keys[sorted_analysts[start].name]
+            end = start + 1
+            while (end < len(sorted_analysts)
+                   and keys[sorted_analysts[end].name] == key):
+                end += 1
+            if end - start > 1:
+                tied = rng.sample(sorted_analysts[start:end], end - start)
+                if run is not None:
+                    for winner, loser in zip(tied, tied[1:]):
+                        run.record_tiebreak(winner, loser, team)
+                sorted_analysts[start:end] = tied
+            start = end
         return sorted_analysts
 
-    def set_placements(self, ranktype, noisy=True):
+    def check_fulltime(self):
+        '''
+        Check, in bulk on the CompactSchema arrays, that fulltime placement
+        is possible: every team that rated an analyst must be among the
+        analyst's preferences, and every analyst must be rated by a team
+        they listed. Every problem is reported together in one Exception.
+        '''
+        compact = self.compact()
+        rated = compact.ratings != UNRATED
+        listed = compact.prefs.T != UNRANKED
+        problems = []
+        for t, a in zip(*np.nonzero(rated & ~listed)):
+            problems.append(f'Cannot find {compact.analyst_names[a]} preference '
+                            f'for {compact.team_names[t]}')
+        for a in np.flatnonzero(~(rated & listed).any(axis=0)):
+            problems.append(f'No team rated {compact.analyst_names[a]}')
+        if problems:
+            raise Exception('\n'.join(problems))
+
+    def fulltime_prefs(self):
+        '''
+        Preprocessing for fulltime placement, where the ratings teams gave an
+        analyst come first in the order the analyst proposes in: the rated
+        teams ordered by rating and then preference, as in
+        CompactSchema.choices. See check_fulltime for the problems reported.
+
+        Returns {analyst_name: inv_prefs} in the same form as
+        Analyst.inv_prefs. Computed once per Schema; do not modify it.
+        '''
+        if self._fulltime_prefs is not None:
+            return self._fulltime_prefs
+        self.check_fulltime()
+        compact = self.compact()
+        team_names = np.array(compact.team_names, dtype=object)
+        fulltime_prefs = {}
+        for name, row in zip(compact.analyst_names, compact.choices('fulltime')):
+            fulltime_prefs[name] = dict(enumerate(team_names[row[row >= 0]].tolist()))
+        self._fulltime_prefs = fulltime_prefs
+        return fulltime_prefs
+
+    def run(self, ranktype, noisy=False, engine='rounds',
+            log_level=LOG_ITERATION, start=None, seed=None,
+            tiebreak='pairwise', profile=None, objective='rank'):
+        '''
+        Place the analysts and return the Run. Nothing on the Schema (or its
+        analysts and teams) is modified, so runs can share one Schema.
+
+        noisy: (bool) Set to True to print the log as the algorithm runs.
+
+        engine: (str) 'rounds' re-sorts every oversubscribed team each
+            iteration. 'heap' runs incremental deferred acceptance, where
+            only rejected analysts propose again and each team only evicts
+            its current worst candidate. Both produce the same placements.
+            'optimal' instead maximizes overall satisfaction, which need
+            not be stable; see place_optimal.
+
+        log_level: (int) How much of the run to keep in run.log, from
+            LOG_OFF to LOG_PROPOSAL. See EventLog.
+
+        start: (list) Heap engine only. Where in its proposal order each
+            analyst starts proposing. See place_heap and rematch.
+
+        seed: Seeds the run's random tiebreaks.
+
+        tiebreak: (str) 'pairwise', 'single' or 'multiple'. See Run.
+
+        profile: Hooks to wrap the run in, e.g. profile_cpu. See Run.
+
+        objective: (str) 'rank' or 'rating', for the 'optimal' engine.
+        '''
+        run = Run(self, ranktype, engine, log_level, noisy, seed, tiebreak,
+                  profile, objective)
+        for _ in self.steps(run, start):
+            pass
+        return run
+
+    def stream(self, run, start=None):
+        '''
+        Carry out run (a new Run over this Schema), yielding its log events
+        as they happen instead of keeping them: each event is handed out
+        once, in the (level, kind, data) form of EventLog.events, so memory
+        holds one iteration's worth of log at most. Use
+        EventLog.render_event to turn an event into text.
+
+        With the rounds engine every iteration event (rejections per team
+        and how many analysts are still unassigned) arrives as soon as that
+        iteration is over, so the caller can show progress, write the log
+        out or stop early. The heap engine has no iterations and yields
+        everything at the end. Once the 'converged' event has been yielded,
+        run.placements is set.
+        '''
+        for _ in self.steps(run, start):
+            yield from run.log.drain()
+
+    def steps(self, run, start=None):
+        '''Carry out run, pausing (yielding None) after each step. See run()
+        and stream().
+        '''
+        log = run.log
+        with contextlib.ExitStack() as hooks:
+            for hook in run.hooks:
+                hooks.enter_context(hook(run))
+            if log.enabled(LOG_SUMMARY):
+                log.add(LOG_SUMMARY, 'start', Analysts=self.n_analysts,
+                        Teams=self.n_teams, Ranktype=run.ranktype,
+                        Engine=run.engine)
+            yield
+            if run.tiebreak != 'pairwise' and run.engine != 'optimal':
+                with run.stats.timed('Preprocessing'):
+                    run.draw_lottery()
+            if run.engine == 'optimal':
+                placements = self.place_optimal(run)
+            elif run.engine == 'heap':
+                placements = self.place_heap(run, start)
+            else:
+                placements = yield from self.place_rounds(run)
+            if run.assigned is None:
+                run.assigned = assigned_teams(self.compact(), placements)
+            if run.strict is not None:
+                with run.stats.timed('Tie Report'):
+                    self.report_lottery(run)
+            if run.engine == 'optimal':
+                if log.enabled(LOG_SUMMARY):
+                    log.add(LOG_SUMMARY, 'optimal', Objective=run.objective,
+                            Cost=run.stats['Total Cost'])
+            elif log.enabled(LOG_SUMMARY):
+                log.add(LOG_SUMMARY, 'converged',
+                        Iterations=run.stats['Iterations'] or None,
+                        Proposals=run.stats['Proposals'],
+                        Tiebreakers=run.random_tbs)
+            run.placements = placements
+        yield
+
+    def lottery_ties(self, run):
+        '''
+        The rejections the lottery decided, in a finished run with a
+        lottery. Returns (analysts, teams, cutoff): the ids of every analyst
+        and team where the team rejected the analyst although they were
+        tied on precedence with the last analyst it kept, and each team's
+        cutoff, the precedence key of that last analyst (NO_PRIORITY for
+        teams with room to spare, which rejected nobody).
+        '''
+        compact = self.compact()
+        priority = compact.priority(run.ranktype)
+        choices = compact.choices(run.ranktype)
+        placed = np.flatnonzero(run.assigned >= 0)
+        held_on = run.assigned[placed]
+        #The lottery only breaks ties, so the last analyst kept in strict
+        #order has the team's largest precedence key.
+        cutoff = np.full(compact.n_teams, -1, dtype=np.int64)
+        np.maximum.at(cutoff, held_on, priority[held_on, placed])
+        full = np.bincount(held_on, minlength=compact.n_teams) >= compact.headcount
+        cutoff[~full | (cutoff < 0)] = NO_PRIORITY
+        exhausted = np.array([run.prefs_exhausted[name]
+                              for name in compact.analyst_names])
+        positions = np.arange(choices.shape[1])
+        rejected_by = positions[None, :] < exhausted[:, None]
+        a, k = np.nonzero(rejected_by)
+        t = choices[a, k]
+        lost = priority[t, a] == cutoff[t]
+        return a[lost], t[lost], cutoff
+
+    def report_lottery(self, run):
+        '''
+        Fill in run.tie_report: for each team, how many of the analysts it
+        rejected were tied on precedence with the last analyst it kept, so
+        that only the lottery kept them off the team. Teams with room to
+        spare rejected nobody. See lottery_ties.
+        '''
+        compact = self.compact()
+        _, t, _ = self.lottery_ties(run)
+        counts = np.bincount(t, minlength=compact.n_teams)
+        run.tie_report = {compact.team_names[t]: int(n)
+                          for t, n in enumerate(counts) if n}
+        run.random_tbs = int(counts.sum())
+        if run.log.enabled(LOG_SUMMARY):
+            run.log.add(LOG_SUMMARY, 'lottery', Mode=run.tiebreak,
+                        Decided=run.tie_report)
+
+    def set_placements(self, ranktype, noisy=True, engine='rounds',
+                       log_level=LOG_ITERATION, start=None):
         '''
         For now, only doing inter-rotational placements!
 
         fulltime_class: (int) Denotes the senior-most class that the algorithm
             should consider for full-time, rather than inter-rotational,
-            placement. CURRENTLY NOT IN USE.
+            placement. CURRENTLY NOT IN USE; see run_tiers.
 
         noisy: (bool) Set to True for messaging about the algorithm's
             iterations, or False if you want it to run quietly, with no
             messages.
+
+        Runs the placement (see run() for the other arguments) and returns
+        the placements. The run's log, stats and tiebreaks are also copied
+        onto the Schema, which makes this form unsafe for concurrent use;
+        prefer run().
+        '''
+        run = self.run(ranktype, noisy, engine, log_level, start)
+        self.placements = run.placements
+        self.log = run.log
+        self.stats = run.stats
+        self.random_tbs = run.random_tbs
+        self.random_tbs_data = run.random_tbs_data
+        return run.placements
+
+    def place_rounds(self, run):
         '''
+        The original engine: every analyst proposes to their top choice, then
+        each iteration every oversubscribed team keeps its best analysts and
+        the rest propose to their next choice, until nobody is rejected.
 
+        A generator that yields after every iteration and returns the
+        placements; see steps().
+        '''
+        ranktype = run.ranktype
+        log = run.log
+        stats = run.stats
+        with stats.timed('Preprocessing'):
+            if ranktype == 'fulltime':
+                inv_prefs = self.fulltime_prefs()
+            else:
+                inv_prefs = {analyst.name: analyst.inv_prefs for analyst in self.analysts}
+            if run.strict is None:
+                self.sort_keys(ranktype)
+        exhausted = run.prefs_exhausted
         placements = {team.name: [] for team in self.teams}
-        if ranktype == 'fulltime':
-            #TODO: Clean this up some day.
-            #Need to do some very hacky stuff to re-order optimization criteria.
-            for analyst in self.analysts:
-                new_inv_prefs = {} #Overriding the hierarchy
-                teams_ratings = [] #What the teams ranked them. (team, their_rank, your_rank)
-                for team in self.teams:
-                    for rated_analyst, rating in team.ratings.items():
-                        if rated_analyst == analyst.name:
-                            try:
-                                analyst_pref = analyst.prefs[team.name]
-                            except KeyError:
-                                msg = f'Cannot find {analyst.name} preference for {team.name}'
-                                raise Exception(msg)
-                            teams_ratings.append((team.name, rating, analyst_pref))
-                #Sorting. Very ugly. Not readable.
-                sorted_teams_ratings = sorted(teams_ratings, key=lambda row: (row[1], row[2]))
-                new_inv_prefs = {i: team_tuple[0] for i, team_tuple in enumerate(sorted_teams_ratings, 0)}
-                print('heres that thing')
-                print(new_inv_prefs)
-                analyst.inv_prefs = new_inv_prefs
+        rejections = stats['Rejections']
 
-        for analyst in self.analysts:
-            top_team = analyst.inv_prefs[0]
-            placements[top_team].append(analyst)
+        log_proposals = log.enabled(LOG_PROPOSAL)
+        with stats.timed('Initial Proposals'):
+            for analyst in self.analysts:
+                exhausted[analyst.name] = 0
+                try:
+                    top_team = inv_prefs[analyst.name][0]
+                except KeyError:
+                    msg = f'We are unable to place {analyst.name} on a team.'
+                    raise Exception(msg)
+                placements[top_team].append(analyst)
+                if log_proposals:
+                    log.add(LOG_PROPOSAL, 'proposal', Analyst=analyst.name,
+                            From=None, To=top_team)
+        proposals = self.n_analysts
 
         converged = False
         i = 1
         while not converged:
-            unassigned_analysts = []
-            iteration = 'Iteration {}'.format(i)
-            self.log[iteration] = {}
-            self.record('#### Iteration {} ####'.format(i), noisy)
-            self.record('Starting Placements:', noisy)
-            self.record(placements, noisy)
-            self.log[iteration]['Starting Placements'] = placements
+            sorting = time.perf_counter()
+            rejected = {}
             for team in self.teams:
                 tn = team.name
                 if len(placements[tn]) > team.headcount:
                     sorted_analysts = self.sort_analysts(placements[tn],
-                                                         team, ranktype)
-                    staying_analysts = sorted_analysts[:team.headcount]
-                    leaving_analysts = sorted_analysts[team.headcount:]
-                    placements[tn] = staying_analysts
-                    unassigned_analysts += leaving_analysts
-            self.record('Sorted Placements:', noisy)
-            self.record(placements, noisy)
-            self.log[iteration]['Sorted Placements'] = placements
-
-            for analyst in unassigned_analysts:
-                analyst.prefs_exhausted += 1
-                try:
-                    next_team = analyst.inv_prefs[analyst.prefs_exhausted]
-                except:
-                    msg = f'We are unable to place {analyst.name} on a team.'
-                    raise Exception(msg)
-                placements[next_team].append(analyst)
-
-            if unassigned_analysts:
-                n_unassigned = str(len(unassigned_analysts))
-                self.record('{} still unassigned:'.format(n_unassigned), noisy)
-                self.record(unassigned_analysts, noisy)
-                self.record('', noisy)
-                self.log[iteration]['Unassigned Analysts'] = unassigned_analysts
-                converged = False
-            else:
-                self.record('At last! Convergence.', noisy)
-                self.record('\nTiebreakers Used: {}'.format(str(self.random_tbs)),
-                            noisy)
-                if self.random_tbs:
-                    self.record(self.random_tbs_data, noisy)
-                converged = True
-            self.log[iteration]['Converged'] = converged
+                                                         team, ranktype, run)
+                    placements[tn] = sorted_analysts[:team.headcount]
+                    rejected[tn] = sorted_analysts[team.headcount:]
+                    rejections[tn] = rejections.get(tn, 0) + len(rejected[tn])
+
+            logging = time.perf_counter()
+            stats.add_time('Sorting', logging - sorting)
+            n_unassigned = sum(len(leaving) for leaving in rejected.values())
+            if log.enabled(LOG_ITERATION):
+                names = {tn: [analyst.name for analyst in leaving_analysts]
+                         for tn, leaving_analysts in rejected.items()}
+                log.add(LOG_ITERATION, 'iteration', Iteration=i,
+                        Rejected=names, Unassigned=n_unassigned)
+
+            reassignment = time.perf_counter()
+            stats.add_time('Logging', reassignment - logging)
+            for tn, leaving_analysts in rejected.items():
+                for analyst in leaving_analysts:
+                    exhausted[analyst.name] += 1
+                    try:
+                        next_team = inv_prefs[analyst.name][exhausted[analyst.name]]
+                    except KeyError:
+                        msg = f'We are unable to place {analyst.name} on a team.'
+                        raise Exception(msg)
+                    placements[next_team].append(analyst)
+                    if log_proposals:
+                        log.add(LOG_PROPOSAL, 'proposal', Analyst=analyst.name,
+                                From=tn, To=next_team)
+            stats.add_time('Reassignment', time.perf_counter() - reassignment)
+            proposals += n_unassigned
+            converged = not n_unassigned
             i += 1
+            stats['Iterations'] = i - 1
+            stats['Proposals'] = proposals
+            if not converged:
+                yield
+
+        return placements
+
+    def verify(self, placements, ranktype):
+        '''
+        Check that placements (of Analysts or analyst names) are a stable
+        matching for ranktype. A blocking pair is an analyst and a team the
+        analyst would rather be on (earlier in the analyst's proposal order)
+        where the team has a free seat, or holds someone the analyst takes
+        strict precedence over. Ties in precedence do not block.
+
+        Returns a dict with:
+        Stable: (bool) No blocking pairs, and every analyst placed once
+            within headcount.
+        Blocking Pairs: (DataFrame) Analyst, Team, Placed On, Choice (the
+            team's position in the analyst's proposal order, 0 first) and
+            Displaces (the team's worst held analyst, or None for a free
+            seat).
+        Unplaced, Placed Twice: (list) Analyst names.
+        Over Capacity: (dict) {team_name: analysts above headcount}.
+        '''
+        compact = self.compact()
+        assigned = np.full(compact.n_analysts, -1, dtype=np.int32)
+        counts = np.zeros(compact.n_analysts, dtype=np.int32)
+        held = np.zeros(compact.n_teams, dtype=np.int32)
+        for team_name, analysts in placements.items():
+            t = compact.team_ids[team_name]
+            ids = [compact.analyst_ids[getattr(analyst, 'name', analyst)]
+                   for analyst in analysts]
+            assigned[ids] = t
+            np.add.at(counts, ids, 1)
+            held[t] = len(ids)
+
+        pairs, worst = blocking_pairs(compact.priority(ranktype),
+                                      compact.choice_ranks(ranktype),
+                                      assigned, compact.headcount)
+        a, t = pairs
+        names = np.array(compact.analyst_names, dtype=object)
+        team_names = np.array(compact.team_names + [None], dtype=object)
+        displaced = worst[t]
+        report = pd.DataFrame({
+            'Analyst': names[a],
+            'Team': team_names[t],
+            'Placed On': team_names[assigned[a]],
+            'Choice': compact.choice_ranks(ranktype)[a, t],
+            'Displaces': np.where(displaced >= 0, names[np.maximum(displaced, 0)], None),
+        })
+        over = held - compact.headcount
+        result = {
+            'Blocking Pairs': report,
+            'Unplaced': list(names[counts == 0]),
+            'Placed Twice': list(names[counts > 1]),
+            'Over Capacity': {compact.team_names[t]: int(n)
+                              for t, n in enumerate(over) if n > 0},
+        }
+        result['Stable'] = not (len(report) or result['Unplaced']
+                                or result['Placed Twice']
+                                or result['Over Capacity'])
+        return result
+
+    def headcount_scenarios(self, deltas=(-1, 1)):
+        '''One scenario per team and delta, changing only that team's
+        headcount, for use with sweep_headcounts.
+        '''
+        scenarios = []
+        for team in self.teams:
+            for delta in deltas:
+                if team.headcount + delta >= 0:
+                    scenarios.append({team.name: team.headcount + delta})
+        return scenarios
+
+    def sweep_headcounts(self, scenarios, ranktype, workers=1, seed=None):
+        '''
+        Match the cohort under many headcount scenarios and compare each with
+        the current headcounts.
+
+        scenarios: (list) Each either a dict of {team_name: headcount}
+            overriding some teams, or a full headcount sequence in team order.
+        workers: (int) Size of the process pool; 1 runs in this process and
+            None uses every CPU.
+        seed: Seeds the lottery that breaks precedence ties. One lottery is
+            used for every scenario, so analysts only move because of the
+            headcount change.
+
+        Precedence does not depend on headcount, so the strict per-team
+        orderings are computed once and shared by every run.
+
+        Returns a DataFrame with one row per scenario, after a 'Base' row:
+        the headcount changes, how many analysts moved and who, and how
+        many analysts received each choice.
+        '''
+        if ranktype == 'fulltime':
+            self.check_fulltime()
+        compact = self.compact()
+        lottery = np.random.default_rng(seed).permutation(compact.n_analysts)
+        strict = compact.strict_priority(ranktype, lottery)
+        choices = compact.choices(ranktype)
+        base_held = deferred_acceptance(strict, choices, compact.headcount,
+                                        analyst_names=compact.analyst_names)[0]
+        base = assignment(base_held, compact.n_analysts)
+
+        vectors = []
+        for scenario in scenarios:
+            if isinstance(scenario, dict):
+                vector = compact.headcount.copy()
+                for team_name, headcount in scenario.items():
+                    vector[compact.team_ids[team_name]] = headcount
+            else:
+                vector = np.asarray(scenario, dtype=np.int32)
+                assert len(vector) == compact.n_teams, 'Need one headcount per team.'
+            vectors.append(vector)
+
+        initargs = (strict, choices, compact.prefs, base)
+        if workers == 1:
+            outcomes = [sweep_scenario(*initargs, vector)
+                        for vector in [compact.headcount] + vectors]
+        else:
+            with ProcessPoolExecutor(workers, initializer=_init_sweep,
+                                     initargs=initargs) as pool:
+                outcomes = list(pool.map(_sweep_scenario,
+                                         [compact.headcount] + vectors,
+                                         chunksize=max(1, len(vectors) // 64)))
+
+        rows = []
+        for i, (vector, outcome) in enumerate(zip([compact.headcount] + vectors,
+                                                  outcomes)):
+            changed = np.flatnonzero(vector != compact.headcount)
+            row = {'Scenario': 'Base' if i == 0 else i,
+                   'Changes': ', '.join('{} {:+d}'.format(
+                       compact.team_names[t],
+                       int(vector[t]) - int(compact.headcount[t])) for t in changed),
+                   'Error': outcome.get('Error')}
+            if 'Moved' in outcome:
+                row['Moved'] = len(outcome['Moved'])
+                row['Moved Analysts'] = [compact.analyst_names[a] for a in outcome['Moved']]
+                for rank, count in enumerate(outcome['Ranks']):
+                    row['Choice {}'.format(rank + 1)] = int(count)
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+    def run_tiers(self, tiers, engine='rounds', log_level=LOG_OFF, seed=None,
+                  tiebreak='pairwise', objective='rank'):
+        '''
+        Place the cohort in ordered tiers, e.g. seniors for fulltime first
+        and everyone else for rotation with the headcount that is left:
+
+            schema.run_tiers([('fulltime', [3]), ('rotation', [1, 2])])
+
+        tiers: (list) (ranktype, classes) pairs, where classes lists the
+            analyst classes in the tier, or is None for every analyst not
+            in an earlier tier.
+        The other arguments are as for run(); each tier gets its own seed
+        derived from seed.
+
+        A generator yielding (tier, run) as each tier finishes, so the
+        caller sees every tier's placements and stats straight away. Each
+        run is over a Schema of just that tier's analysts, with the seats
+        filled by earlier tiers taken out of the headcount. The tiers all
+        share this Schema's CompactSchema indexes, proposal orders and
+        precedence keys, which are computed once for the whole cohort.
+        Use merge_placements to combine the runs.
+        '''
+        compact = self.compact()
+        remaining = compact.headcount.copy()
+        unplaced = np.ones(compact.n_analysts, dtype=bool)
+        for rank_type in {ranktype for ranktype, classes in tiers}:
+            compact.choices(rank_type)
+            compact.choice_ranks(rank_type)
+            compact.priority(rank_type)
+        if seed is not None:
+            children = np.random.SeedSequence(seed).spawn(len(tiers))
+
+        for i, (ranktype, classes) in enumerate(tiers):
+            members = unplaced.copy()
+            if classes is not None:
+                members &= np.isin(compact.clas, classes)
+            ids = np.flatnonzero(members)
+            unplaced &= ~members
+            tier_schema = Schema.from_compact(compact.subset(ids, remaining.copy()))
+            tier_seed = None if seed is None else int(children[i].generate_state(1)[0])
+            run = tier_schema.run(ranktype, engine=engine, log_level=log_level,
+                                  seed=tier_seed, tiebreak=tiebreak,
+                                  objective=objective)
+            for team, analysts in run.placements.items():
+                remaining[compact.team_ids[team]] -= len(analysts)
+            yield (ranktype, classes), run
+
+    def rematch(self, placements, ranktype, edits, log_level=LOG_OFF,
+                seed=None, tiebreak='pairwise'):
+        '''
+        Repair a stable matching after small edits, instead of building a new
+        Schema and matching from scratch.
+
+        placements: (dict) The placements of a run on this Schema.
+        edits: (list) Tuples of any of:
+            ('add', Analyst)
+            ('remove', analyst_name)
+            ('prefs', analyst_name, prefs)
+            ('headcount', team_name, headcount)
+            ('rating', team_name, analyst_name, rating)
+
+        seed, tiebreak: As for run(), for the repaired run.
+
+        Returns (schema, run) for the edited Schema, where the run's
+        placements are the ones a full run would produce (up to random
+        tiebreaks). This Schema is left untouched. With a lottery, pass the
+        tiebreak and seed of the run placements came from; the placements
+        are then exactly those of a full run with that seed.
+
+        In deferred acceptance every team above an analyst's placement has
+        rejected them, and the result does not depend on the order of the
+        proposals. Edits that can only make analysts worse off (adding an
+        analyst, lowering a headcount, or a rating in rotation placement,
+        where ratings play no part) leave every one of those rejections
+        justified, so each analyst resumes at their old placement, added
+        analysts start at their first choice, and only the proposal chains
+        the edits set off are run. Any other edit (removing an analyst,
+        raising a headcount, new preferences or a fulltime rating) can make
+        a team take someone it rejected before, which may in turn reopen
+        teams far from the edit, so the edited Schema is matched from
+        scratch. So is any edit adding an analyst under a lottery, which
+        redraws the lottery.
+        '''
+        compact = self.compact()
+        assigned = assigned_teams(compact, placements)
+        if (assigned < 0).any():
+            raise ValueError('The placements do not cover every analyst.')
+        new_compact, old_ids = compact.edit(edits)
+
+        def only_worse(edit):
+            if edit[0] == 'add':
+                return tiebreak == 'pairwise'
+            if edit[0] == 'headcount':
+                return edit[2] <= compact.headcount[compact.team_ids[edit[1]]]
+            if edit[0] == 'rating':
+                return ranktype == 'rotation'
+            return False
+
+        start = None
+        if all(only_worse(edit) for edit in edits):
+            old_position = compact.choice_ranks(ranktype)[np.arange(compact.n_analysts),
+                                                          assigned]
+            existing = old_ids >= 0
+            start = np.zeros(new_compact.n_analysts, dtype=np.int64)
+            start[existing] = old_position[old_ids[existing]]
+
+        schema = Schema.from_compact(new_compact)
+        run = schema.run(ranktype, engine='heap', log_level=log_level,
+                         start=start, seed=seed, tiebreak=tiebreak)
+        return schema, run
+
+    def place_heap(self, run, start=None):
+        '''
+        Incremental deferred acceptance on the CompactSchema ids. Each team
+        holds a bounded max-heap of its candidates keyed on precedence, so a
+        new proposal costs O(log headcount): the team either rejects the
+        proposer or evicts its current worst candidate. Only rejected
+        analysts propose again.
+
+        start: (list) The position in each analyst's proposal order to start
+            proposing from, skipping teams known to reject them.
+
+        There are no iterations, so rejections are only logged (as
+        proposals) at LOG_PROPOSAL. With a lottery, teams are keyed on the
+        run's strict positions and never need a tiebreak.
+        '''
+        ranktype = run.ranktype
+        log = run.log
+        stats = run.stats
+        with stats.timed('Preprocessing'):
+            if ranktype == 'fulltime':
+                self.check_fulltime()
+            compact = self.compact()
+            choices = compact.choices(ranktype)
+            priority = compact.priority(ranktype) if run.strict is None else run.strict
+        team_names = compact.team_names
+
+        def tiebreak(a, b, t):
+            winner = run.random_tiebreak(self.analysts[a], self.analysts[b],
+                                         self.teams[t])
+            return winner is self.analysts[a]
+
+        on_proposal = None
+        if log.enabled(LOG_PROPOSAL):
+            def on_proposal(a, previous, t):
+                log.add(LOG_PROPOSAL, 'proposal', Analyst=self.analysts[a].name,
+                        From=None if previous is None else team_names[previous],
+                        To=team_names[t])
+
+        with stats.timed('Matching'):
+            held, exhausted, proposals, comparisons = deferred_acceptance(
+                priority, choices, compact.headcount, start, tiebreak,
+                on_proposal, compact.analyst_names)
+
+        with stats.timed('Assembly'):
+            run.prefs_exhausted = dict(zip(compact.analyst_names, exhausted))
+            run.assigned = assignment(held, compact.n_analysts)
+            placements = {}
+            for team, heap in zip(self.teams, held):
+                placements[team.name] = [self.analysts[a] for _, a in sorted(heap, reverse=True)]
+            counts = rejection_counts(choices, exhausted, start, compact.n_teams)
+            stats['Rejections'] = {team_names[t]: int(n)
+                                   for t, n in enumerate(counts) if n}
+        stats['Proposals'] = proposals
+        stats['Comparisons'] += comparisons
+        return placements
+
+    def place_optimal(self, run):
+        '''
+        Assign every analyst to a team they could be placed on (under the
+        run's rank type) so that the total cost is as low as possible,
+        instead of looking for a stable matching. With objective:
+        'rank': the cost is the analyst's rank of the team (0 for their
+            first choice), so the total preference rank is minimized.
+        'rating': the team's rating of the analyst comes first (best
+            ratings overall, unrated counting as worse than any rating) and
+            the analyst's rank of the team breaks ties.
+
+        Expanding every team into headcount identical slots makes this a
+        linear assignment problem. Because the slots of a team are
+        interchangeable, it is solved in its equivalent transportation form
+        instead: one variable per (analyst, team) pair, every analyst
+        placed once and every team within headcount. Its constraint matrix
+        is totally unimodular, so the simplex solution is a 0/1 assignment.
+        The sparse problem has at most analysts x teams variables whatever
+        the headcounts, which keeps thousands of analysts cheap.
+
+        Needs scipy.
+        '''
+        try:
+            from scipy import sparse
+            from scipy.optimize import linprog
+        except ImportError:
+            raise Exception("The 'optimal' engine needs scipy: pip install scipy")
+        ranktype = run.ranktype
+        stats = run.stats
+        with stats.timed('Preprocessing'):
+            if ranktype == 'fulltime':
+                self.check_fulltime()
+            compact = self.compact()
+            a, t = np.nonzero(compact.choice_ranks(ranktype) < compact.n_teams)
+            stranded = np.bincount(a, minlength=compact.n_analysts) == 0
+            if stranded.any():
+                name = compact.analyst_names[np.flatnonzero(stranded)[0]]
+                raise Exception(f'We are unable to place {name} on a team.')
+            cost = optimal_costs(compact, run.objective)[a, t]
+            n_pairs = len(a)
+            pairs = np.arange(n_pairs)
+            ones = np.ones(n_pairs)
+            analyst_rows = sparse.csr_matrix((ones, (a, pairs)),
+                                             shape=(compact.n_analysts, n_pairs))
+            team_rows = sparse.csr_matrix((ones, (t, pairs)),
+                                          shape=(compact.n_teams, n_pairs))
+
+        with stats.timed('Solving'):
+            result = linprog(cost, A_ub=team_rows, b_ub=compact.headcount,
+                             A_eq=analyst_rows, b_eq=np.ones(compact.n_analysts),
+                             bounds=(0, 1), method='highs-ds')
+        if result.status == 2:
+            raise Exception('There is not enough headcount to place every '
+                            'analyst on a team they could be placed on.')
+        if result.status != 0:
+            raise Exception(f'The optimal assignment failed: {result.message}')
+
+        with stats.timed('Assembly'):
+            chosen = result.x > 0.5
+            a, t = a[chosen], t[chosen]
+            stats['Total Cost'] = int(cost[chosen].sum())
+            #Each team's analysts best-first, like the other engines.
+            priority = compact.priority(ranktype)[t, a]
+            order = np.lexsort((priority, t))
+            a, t = a[order], t[order]
+            run.assigned = np.full(compact.n_analysts, -1, dtype=np.int32)
+            run.assigned[a] = t
+            placements = {team.name: [] for team in self.teams}
+            for analyst_id, team_id in zip(a.tolist(), t.tolist()):
+                placements[compact.team_names[team_id]].append(self.analysts[analyst_id])
+            ranks = compact.choice_ranks(ranktype)[a, t]
+            run.prefs_exhausted = dict(zip([compact.analyst_names[i] for i in a],
+                                           ranks.tolist()))
         return placements
 
-def random_schema(n_analysts, n_teams, extra_spots):
+def optimal_costs(compact, objective):
+    '''(analysts x teams) int64 costs for Schema.place_optimal.'''
+    rank = compact.choice_ranks('rotation').astype(np.int64)
+    if objective == 'rank':
+        return rank
+    ratings = compact.ratings.T.astype(np.int64)
+    rated = ratings != UNRATED
+    worst = ratings[rated].max() + 1 if rated.any() else 1
+    ratings = np.where(rated, ratings, worst)
+    return ratings * (compact.n_teams + 1) + rank
+
+def deferred_acceptance(priority, choices, headcount, start=None, tiebreak=None,
+                        on_proposal=None, analyst_names=None):
+    '''
+    Analyst-proposing deferred acceptance on integer ids, with a bounded
+    max-heap of held analysts per team.
+
+    priority: (teams x analysts) precedence keys, lower wins.
+    choices: (analysts x teams) proposal orders, padded with -1.
+    headcount: (teams) seats per team.
+    start: Position in its proposal order each analyst starts from.
+    tiebreak: (callable) tiebreak(a, b, t) is True if analyst a beats
+        analyst b on team t when their keys are equal. Defaults to a coin
+        flip.
+    on_proposal: (callable) Called as on_proposal(a, previous_t, t) for
+        every proposal; previous_t is None for first proposals.
+    analyst_names: Used for the error raised when an analyst runs out of
+        teams.
+
+    Returns (held, exhausted, proposals, comparisons): held[t] is team t's
+    heap of (-priority, analyst) entries and exhausted[a] the final position
+    of analyst a in its proposal order.
+    '''
+    n_analysts, n_choices = choices.shape
+    headcount = [int(n) for n in headcount]
+    held = [[] for n in headcount]
+    if start is None:
+        exhausted = [0] * n_analysts
+    else:
+        exhausted = [int(k) for k in start]
+    if tiebreak is None:
+        tiebreak = lambda a, b, t: random.random() < 0.5
+    proposing = [(a, None) for a in range(n_analysts - 1, -1, -1)]
+    proposals = 0
+    comparisons = 0
+    while proposing:
+        a, previous = proposing.pop()
+        k = exhausted[a]
+        t = int(choices[a, k]) if k < n_choices else -1
+        if t < 0:
+            name = analyst_names[a] if analyst_names is not None else a
+            msg = f'We are unable to place {name} on a team.'
+            raise Exception(msg)
+        proposals += 1
+        if on_proposal is not None:
+            on_proposal(a, previous, t)
+        entry = (-int(priority[t, a]), a)
+        heap = held[t]
+        if len(heap) < headcount[t]:
+            heapq.heappush(heap, entry)
+            continue
+        rejected = a
+        if heap:
+            comparisons += 1
+            worst = heap[0]
+            if entry[0] > worst[0]:
+                rejected = heapq.heapreplace(heap, entry)[1]
+            elif entry[0] == worst[0] and tiebreak(a, worst[1], t):
+                rejected = heapq.heapreplace(heap, entry)[1]
+        exhausted[rejected] += 1
+        proposing.append((rejected, t))
+    return held, exhausted, proposals, comparisons
+
+def rejection_counts(choices, exhausted, start=None, n_teams=None):
+    '''How many analysts each team rejected, given how far down their
+    proposal orders (from start, if given) the analysts got.
+    '''
+    exhausted = np.asarray(exhausted)
+    first = np.zeros_like(exhausted) if start is None else np.asarray(start)
+    positions = np.arange(choices.shape[1])
+    rejected_by = ((positions[None, :] >= first[:, None])
+                   & (positions[None, :] < exhausted[:, None]))
+    return np.bincount(choices[rejected_by], minlength=n_teams or 0)
+
+def blocking_pairs(priority, choice_ranks, assigned, headcount):
+    '''
+    Every blocking pair of a matching, with array operations over the
+    (analysts x teams) matrices.
+
+    assigned: (analysts) The team id each analyst is on, -1 if none.
+
+    Returns ((analyst ids, team ids), worst), where worst[t] is the id of
+    team t's held analyst with the lowest precedence, or -1 if the team has
+    a free seat.
+    '''
+    n_analysts, n_teams = choice_ranks.shape
+    placed = assigned >= 0
+    ids = np.arange(n_analysts)
+    own_rank = np.full(n_analysts, n_teams, dtype=choice_ranks.dtype)
+    own_rank[placed] = choice_ranks[ids[placed], assigned[placed]]
+    held_priority = np.full(n_analysts, -1, dtype=np.int64)
+    held_priority[placed] = priority[assigned[placed], ids[placed]]
+
+    #Worst held analyst per team: sort by (team, priority) and take the last.
+    order = np.lexsort((held_priority[placed], assigned[placed]))
+    members = ids[placed][order]
+    teams = assigned[placed][order]
+    last = np.flatnonzero(np.r_[teams[1:] != teams[:-1], True])
+    worst = np.full(n_teams, -1, dtype=np.int64)
+    worst[teams[last]] = members[last]
+    full = np.bincount(teams, minlength=n_teams) >= headcount
+    worst[~full] = -1
+    cutoff = np.full(n_teams, NO_PRIORITY, dtype=np.int64)
+    cutoff[full] = priority[full, np.maximum(worst[full], 0)]
+    cutoff[full & (worst < 0)] = -1 #Zero headcount: nobody gets in.
+
+    prefers = choice_ranks < own_rank[:, None]
+    admits = priority.T < cutoff[None, :]
+    return np.nonzero(prefers & admits), worst
+
+def assigned_teams(compact, placements):
+    '''The team id each analyst is placed on in placements (of Analysts or
+    analyst names), -1 if unplaced.
+    '''
+    assigned = np.full(compact.n_analysts, -1, dtype=np.int32)
+    for team_name, analysts in placements.items():
+        ids = [compact.analyst_ids[getattr(analyst, 'name', analyst)]
+               for analyst in analysts]
+        assigned[ids] = compact.team_ids[team_name]
+    return assigned
+
+def assignment(held, n_analysts):
+    '''The team id each analyst is held by, from deferred_acceptance's
+    heaps (-1 if unplaced).
+    '''
+    assigned = np.full(n_analysts, -1, dtype=np.int32)
+    for t, heap in enumerate(held):
+        for _, a in heap:
+            assigned[a] = t
+    return assigned
+
+def sweep_scenario(priority, choices, prefs, base, headcount):
+    '''Match one headcount vector against the shared orderings, and compare
+    the result with the base assignment.
+    '''
+    try:
+        held = deferred_acceptance(priority, choices, headcount)[0]
+    except Exception as e:
+        return {'Error': str(e)}
+    assigned = assignment(held, len(choices))
+    ranks = prefs[np.arange(len(assigned)), assigned]
+    return {'Moved': np.flatnonzero(assigned != base),
+            'Ranks': np.bincount(ranks)}
+
+#Shared, read-only inputs of headcount sweep pool workers (see _init_sweep).
+#Only ever set in worker processes, never in the caller's.
+_SWEEP = {}
+
+def _init_sweep(priority, choices, prefs, base):
+    _SWEEP.update(priority=priority, choices=choices, prefs=prefs, base=base)
+
+def _sweep_scenario(headcount):
+    return sweep_scenario(_SWEEP['priority'], _SWEEP['choices'],
+                          _SWEEP['prefs'], _SWEEP['base'], headcount)
+
+TEAMS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'teams.csv')
+
+@functools.lru_cache(maxsize=None)
+def name_pool():
+    '''The distinct names in the nltk names corpus, loaded once per process.'''
+    allnames = names.words('male.txt') + names.words('female.txt')
+    return tuple(dict.fromkeys(allnames))
+
+@functools.lru_cache(maxsize=None)
+def team_pool(teams_path=TEAMS_PATH):
+    '''The team names in teams.csv, loaded once per process.'''
+    return tuple(pd.read_csv(teams_path).iloc[:, 0].astype(str))
+
+def random_names(rng, n_names):
+    '''Draw n_names distinct names from the corpus. Once the corpus runs out,
+    names repeat with a number appended ("Anna", ..., "Anna 2", ...).
+    '''
+    pool = name_pool()
+    if n_names <= len(pool):
+        return [pool[i] for i in rng.choice(len(pool), n_names, replace=False)]
+    shuffled = [pool[i] for i in rng.permutation(len(pool))]
+    rand_names = list(shuffled)
+    rep = 2
+    while len(rand_names) < n_names:
+        batch = shuffled[:n_names - len(rand_names)]
+        rand_names.extend(f'{name} {rep}' for name in batch)
+        rep += 1
+    return rand_names
+
+def random_schema(n_analysts, n_teams, extra_spots, seed=None):
     '''Create a random Schema, with random names, teams, and other variables.
     n_analysts: (int) The number of analysts.
     n_teams: (int) The number of teams.
     extra_spots: (int) The number of additional spots beyond the minimum
         possible (i.e. the number of analysts.)
+    seed: (int or numpy.random.Generator) For reproducible schemas.
+
+    Everything is drawn in bulk into a CompactSchema, so the analysts and
+    teams of the returned Schema are views over its arrays.
     '''
     MAX_PERF = 5
     MAX_RATING = 5
     CLASSES = [1,2,3]
 
-    teams_path = "teams.csv"
-    allnames = names.words('male.txt') + names.words('female.txt')
-    teams = pd.read_csv(teams_path, header=None)[0].to_list()
+    teams = team_pool()
     assert n_teams <= len(teams), 'Too many teams.'
     assert extra_spots >= 0, 'Invalid number.'
+    rng = np.random.default_rng(seed)
+
+    rand_names = random_names(rng, n_analysts)
+    rand_teams = [teams[i] for i in rng.choice(len(teams), n_teams, replace=False)]
 
-    rand_names = random.sample(allnames, n_analysts)
-    rand_teams = random.sample(teams, n_teams)
-
-    analysts = []
-    for name in rand_names:
-        rand_perf = random.randint(1, MAX_PERF)
-        rand_class = random.sample(CLASSES, 1)[0]
-        rand_team_order = random.sample(rand_teams, len(rand_teams))
-        rand_prefs = {}
-        for i, team in enumerate(rand_team_order):
-            rand_prefs[team] = i
-        analyst = Analyst(name, rand_class, rand_perf, rand_prefs)
-        analysts.append(analyst)
-
-    teams = []
-    for team_name in rand_teams:
-        rand_ratings = {}
-        for analyst in rand_names:
-            rand_ratings[analyst] = random.randint(1, MAX_RATING)
-        team = Team(team_name, 1, rand_ratings)
-        teams.append(team)
+    rand_perf = rng.integers(1, MAX_PERF, size=n_analysts, endpoint=True)
+    rand_class = rng.choice(CLASSES, size=n_analysts)
+    #Each row is a random permutation of the ranks 0..n_teams-1.
+    rand_prefs = rng.permuted(np.tile(np.arange(n_teams, dtype=np.int16),
+                                      (n_analysts, 1)), axis=1)
+    rand_ratings = rng.integers(1, MAX_RATING, size=(n_teams, n_analysts),
+                                endpoint=True)
 
     total_spots = n_analysts + extra_spots
-    remaining_spots = total_spots - n_teams
-    for i in range(remaining_spots):
-        rand_index = random.randint(0, n_teams-1)
-        teams[rand_index].headcount += 1
+    remaining_spots = max(total_spots - n_teams, 0)
+    headcount = 1 + rng.multinomial(remaining_spots, np.full(n_teams, 1 / n_teams))
 
-    schema = Schema(analysts, teams)
+    compact = CompactSchema(rand_names, rand_teams, rand_class, rand_perf,
+                            rand_prefs, headcount, rand_ratings)
+    schema = Schema.from_compact(compact)
     return schema
 
+PERF_MAP = {'Top': 4, 'Exceeds': 3, 'Meets': 2, 'Low': 1}
+
+def _column(df, col):
+    '''A column by position (int) or by header.'''
+    return df.iloc[:, col] if isinstance(col, int) else df[col]
+
+def _as_str(values):
+    '''Cell values as strings, leaving blanks as NaN.'''
+    return values.where(values.isna(), values.astype(str))
+
+def _report(errors, what):
+    '''Raise one Exception listing every (row, problem) in errors.'''
+    if errors:
+        lines = ['Row {}: {}'.format(row, problem) if row is not None else problem
+                 for row, problem in sorted(errors, key=lambda e: e[0] or 0)]
+        msg = '{} problem(s) in the {} data:\n'.format(len(errors), what)
+        raise Exception(msg + '\n'.join(lines))
+
+def analyst_columns(df, team_index, name_col, class_col, perf_col, choice_cols,
+                    perf_map=PERF_MAP):
+    '''Map one DataFrame (or chunk) of analyst rows to arrays, in bulk.
+    team_index: (pandas.Index) The team names, in team id order.
+    class_col: The class is the last character of this column ("C2" is 2).
+        None gives every analyst class 0.
+    choice_cols: Columns holding the analyst's first, second, ... choice of
+        team. Blank cells are allowed.
+
+    Returns (names, clas, perf, choices, errors, rows), where choices[a, j]
+    is the team id of analyst a's j-th choice (-1 if blank), errors lists
+    (row, problem) for the bad rows and rows numbers the analysts as in the
+    file, with the header as row 1.
+    '''
+    df = df.dropna(how='all')
+    rows = df.index + 2
+    errors = []
+
+    names = _as_str(_column(df, name_col))
+    for row in rows[names.isna().to_numpy()]:
+        errors.append((row, 'missing analyst name.'))
+
+    if class_col is None:
+        clas = np.zeros(len(df), dtype=np.int32)
+    else:
+        raw = _column(df, class_col)
+        #Only parse each distinct value once; there are only a few classes.
+        codes, distinct = pd.factorize(raw, use_na_sentinel=False)
+        distinct = pd.to_numeric(pd.Series(distinct).astype(str).str[-1],
+                                 errors='coerce')
+        clas = pd.Series(distinct.to_numpy()[codes], index=raw.index)
+        for row, value in zip(rows[clas.isna().to_numpy()], raw[clas.isna()]):
+            errors.append((row, f'cannot read class {value!r}.'))
+        clas = clas.fillna(0).to_numpy(dtype=np.int32)
+
+    raw = _column(df, perf_col)
+    perf = raw.map(perf_map)
+    for row, value in zip(rows[perf.isna().to_numpy()], raw[perf.isna()]):
+        errors.append((row, f'unknown performance {value!r}, '
+                            f'expected one of {", ".join(map(str, perf_map))}.'))
+    perf = perf.fillna(0).to_numpy(dtype=np.int32)
+
+    choices = np.full((len(df), len(choice_cols)), -1, dtype=np.int32)
+    for j, col in enumerate(choice_cols):
+        values = _as_str(_column(df, col))
+        ids = team_index.get_indexer(values)
+        unknown = (ids < 0) & values.notna().to_numpy()
+        for row, value in zip(rows[unknown], values[unknown]):
+            errors.append((row, f'unknown team {value!r}.'))
+        choices[:, j] = ids
+    return (names.to_numpy(dtype=object), clas, perf, choices, errors,
+            rows.to_numpy())
+
+def team_columns(df, team_col, headcount_col):
+    '''Map the team rows to (names, headcount, errors), in bulk. See
+    analyst_columns.
+    '''
+    df = df.dropna(how='all')
+    rows = df.index + 2
+    errors = []
+    names = _as_str(_column(df, team_col)) #str() because 42
+    for row in rows[names.isna().to_numpy()]:
+        errors.append((row, 'missing team name.'))
+    duplicated = (names.duplicated() & names.notna()).to_numpy()
+    for row, name in zip(rows[duplicated], names[duplicated]):
+        errors.append((row, f'duplicate team {name!r}.'))
+    raw = _column(df, headcount_col)
+    headcount = pd.to_numeric(raw, errors='coerce')
+    bad = (headcount.isna() | (headcount < 0) | (headcount % 1 != 0)).to_numpy()
+    for row, value in zip(rows[bad], raw[bad]):
+        errors.append((row, f'invalid headcount {value!r}.'))
+    headcount = headcount.where(~bad, 0).to_numpy(dtype=np.int32)
+    return names.to_numpy(dtype=object), headcount, errors
+
+def rating_matrix(df, rating_cols, analyst_index):
+    '''Map rating columns to a (teams x analysts) rating matrix. Each column
+    header is a rating and its cells name the analysts the team gave it.
+    '''
+    df = df.dropna(how='all')
+    rows = df.index + 2
+    errors = []
+    ratings = np.full((len(df), len(analyst_index)), UNRATED, dtype=np.int32)
+    for col in rating_cols:
+        header = df.columns[col] if isinstance(col, int) else col
+        try:
+            rating = int(header)
+        except ValueError:
+            errors.append((None, f'column {header!r} is not a rating; rating '
+                                 'column headers must be numbers.'))
+            continue
+        values = _as_str(_column(df, col))
+        ids = analyst_index.get_indexer(values)
+        given = values.notna().to_numpy()
+        unknown = (ids < 0) & given
+        for row, value in zip(rows[unknown], values[unknown]):
+            errors.append((row, f'unknown analyst {value!r} rated {rating}.'))
+        valid = given & ~unknown
+        ratings[np.flatnonzero(valid), ids[valid]] = rating
+    return ratings, errors
+
+def schema_from_frames(analyst_frames, team_df, name_col=1, class_col=2,
+                       perf_col=3, choice_cols=(4, 5, 6), team_col=0,
+                       headcount_col=1, rating_cols=None, perf_map=PERF_MAP):
+    '''
+    Build a Schema straight from columns of analyst and team data. Every
+    column is parsed and validated in bulk, and the arrays go directly into
+    a CompactSchema, with no Analyst or Team objects built along the way.
+    Columns are given by position (int) or by header.
+
+    analyst_frames: A DataFrame, or an iterable of DataFrame chunks such as
+        pandas.read_csv(..., chunksize=n). Only the parsed arrays of each
+        chunk are kept.
+    choice_cols: The analysts' first, second, ... choice columns.
+    rating_cols: Team columns for fulltime ratings (see rating_matrix).
+
+    All bad rows are reported together in one Exception.
+    '''
+    team_names, headcount, errors = team_columns(team_df, team_col, headcount_col)
+    _report(errors, 'team')
+    team_index = pd.Index(team_names)
+
+    if isinstance(analyst_frames, pd.DataFrame):
+        analyst_frames = [analyst_frames]
+    parts = [analyst_columns(df, team_index, name_col, class_col, perf_col,
+                             choice_cols, perf_map) for df in analyst_frames]
+    errors = [error for part in parts for error in part[4]]
+    names = np.concatenate([part[0] for part in parts])
+    analyst_index = pd.Index(names)
+    duplicated = analyst_index.duplicated() & pd.notna(names)
+    rows = np.concatenate([part[5] for part in parts])
+    for row, name in zip(rows[duplicated], names[duplicated]):
+        errors.append((row, f'duplicate analyst {name!r}.'))
+    _report(errors, 'analyst')
+    clas = np.concatenate([part[1] for part in parts])
+    perf = np.concatenate([part[2] for part in parts])
+    choices = np.concatenate([part[3] for part in parts])
+
+    prefs = np.full((len(names), len(team_names)), UNRANKED, dtype=np.int16)
+    for j in range(choices.shape[1]):
+        valid = np.flatnonzero(choices[:, j] >= 0)
+        prefs[valid, choices[valid, j]] = j
+
+    ratings = None
+    if rating_cols is not None:
+        ratings, errors = rating_matrix(team_df, rating_cols, analyst_index)
+        _report(errors, 'team')
+
+    compact = CompactSchema(names, team_names, clas, perf, prefs, headcount,
+                            ratings)
+    return Schema.from_compact(compact)
+
+def read_csv(analyst_fp, team_fp, chunksize=100000, **columns):
+    '''Processes CSV files of analyst and team data into a Schema object,
+    reading the analysts chunksize rows at a time. columns are passed on to
+    schema_from_frames.
+    '''
+    team_df = pd.read_csv(team_fp)
+    with pd.read_csv(analyst_fp, chunksize=chunksize) as chunks:
+        return schema_from_frames(chunks, team_df, **columns)
+
 def read_excel(fp, analyst_sheet, team_sheet, name_col=1, class_col=2,
                perf_col=3, prefs_col_start=4, prefs_col_end=6, team_col=0,
                headcount_col=1, ratings_col_start=None, ratings_col_end=None):
@@ -320,42 +1993,148 @@ def read_excel(fp, analyst_sheet, team_sheet, name_col=1, class_col=2,
     fp: (str) Excel File path
     analyst_sheet: Name of the sheet containing analyst data.
     team_sheet: Name of the sheet containing team data. Optional.
+    ratings_col_start, ratings_col_end: Team columns holding fulltime
+        ratings, if any. See rating_matrix.
     '''
-    clas_lambda = lambda x: int(x[-1])
-    perf_map = {'Top': 4, 'Exceeds': 3, 'Meets': 2, 'Low': 1}
-    perf_lambda = lambda x: perf_map[x]
-
-    pref_col_range = [i for i in range(prefs_col_start, prefs_col_end+1)]
-    n_pref_cols = prefs_col_end - prefs_col_start
-    cols_to_keep = [name_col] + [class_col] + [perf_col]+ pref_col_range
     analyst_df = pd.read_excel(fp, analyst_sheet)
-    analyst_df = analyst_df.iloc[:,cols_to_keep]
-    overwrite_cols = ['Name', 'Class', 'Performance'] + [i for i in range(n_pref_cols+1)]
-    analyst_df.columns = overwrite_cols
-    analysts_dict = analyst_df.to_dict(orient='rows')
-
-    analysts = []
-    for analyst in analysts_dict:
-        name = analyst['Name']
-        clas = clas_lambda(analyst['Class'])
-        perf = perf_lambda(analyst['Performance'])
-        prefs = {str(v):k for k,v in analyst.items() if k not in ('Name', 'Class')}
-        new_analyst = Analyst(name, clas, perf, prefs)
-        analysts.append(new_analyst)
-
-    cols_to_keep = [team_col] + [headcount_col]
     team_df = pd.read_excel(fp, team_sheet)
-    team_df.iloc[:,cols_to_keep]
-    overwrite_cols = ['Team', 'Headcount']
-    team_df.columns = overwrite_cols
-    team_dict = team_df.to_dict(orient='rows')
-
-    teams = []
-    for team in team_dict:
-        name = str(team['Team']) #str() because 42
-        headcount = team['Headcount']
-        new_team = Team(name, headcount)
-        teams.append(new_team)
-
-    schema = Schema(analysts, teams)
-    return schema
+    rating_cols = None
+    if ratings_col_start is not None:
+        rating_cols = list(range(ratings_col_start, ratings_col_end+1))
+    return schema_from_frames(analyst_df, team_df, name_col, class_col,
+                              perf_col,
+                              list(range(prefs_col_start, prefs_col_end+1)),
+                              team_col, headcount_col, rating_cols)
+
+SNAPSHOT_FORMAT = 1
+
+def save_snapshot(path, schema, run=None):
+    '''
+    Save a Schema, and optionally a finished Run over it, to the directory
+    path, so the match can be reloaded, re-verified or rerun later without
+    the original files. Every array (the CompactSchema, the placements,
+    the tie lottery) is written as its own .npy file, which load_snapshot
+    can memory-map; names, stats and the event log go in meta.json.
+    '''
+    os.makedirs(path, exist_ok=True)
+    compact = schema.compact()
+    arrays = {'clas': compact.clas, 'perf': compact.perf,
+              'prefs': compact.prefs, 'headcount': compact.headcount}
+    if compact.has_ratings:
+        arrays['ratings'] = compact.ratings
+    meta = {'Format': SNAPSHOT_FORMAT,
+            'Analysts': compact.analyst_names,
+            'Teams': compact.team_names,
+            'Run': None}
+
+    if run is not None:
+        assert run.placements is not None, 'The run has not finished.'
+        placed = [compact.analyst_ids[analyst.name]
+                  for team in compact.team_names
+                  for analyst in run.placements[team]]
+        arrays['placed'] = np.array(placed, dtype=np.int32)
+        arrays['team_sizes'] = np.array([len(run.placements[team])
+                                         for team in compact.team_names],
+                                        dtype=np.int32)
+        arrays['exhausted'] = np.array([run.prefs_exhausted.get(name, 0)
+                                        for name in compact.analyst_names],
+                                       dtype=np.int32)
+        if run.strict is not None:
+            arrays['lottery'] = run.strict
+        arrays['tied'] = np.asarray(run.tied_ids, dtype=np.int32)
+        tiebreaks = [{'Winner': report['Winner'].name,
+                      'Loser': report['Loser'].name,
+                      'Team': report['Team'].name,
+                      'Rank Type': report['Rank Type']}
+                     for report in run.random_tbs_data]
+        meta['Run'] = {'Rank Type': run.ranktype, 'Engine': run.engine,
+                       'Tiebreak': run.tiebreak, 'Objective': run.objective,
+                       'Seed': run.seed, 'Log Level': run.log.level,
+                       'Stats': run.stats, 'Random Tiebreaks': run.random_tbs,
+                       'Tiebreaks': tiebreaks, 'Tie Report': run.tie_report,
+                       'Log': [[level, kind, data]
+                               for level, kind, data in run.log.events]}
+
+    for name, array in arrays.items():
+        np.save(os.path.join(path, name + '.npy'), np.ascontiguousarray(array))
+    with open(os.path.join(path, 'meta.json'), 'w') as file:
+        json.dump(meta, file, default=int)
+
+def load_snapshot(path, mmap=True):
+    '''
+    Load what save_snapshot wrote. Returns (schema, run), where run is None
+    if no run was saved. With mmap, the arrays are memory-mapped read-only
+    rather than read into memory, so even large cohorts load at once.
+    '''
+    with open(os.path.join(path, 'meta.json')) as file:
+        meta = json.load(file)
+    if meta['Format'] != SNAPSHOT_FORMAT:
+        raise Exception(f"Unknown snapshot format {meta['Format']}.")
+
+    def load(name):
+        fp = os.path.join(path, name + '.npy')
+        if not os.path.exists(fp):
+            return None
+        return np.load(fp, mmap_mode='r' if mmap else None)
+
+    compact = CompactSchema(meta['Analysts'], meta['Teams'], load('clas'),
+                            load('perf'), load('prefs'), load('headcount'),
+                            load('ratings'))
+    schema = Schema.from_compact(compact)
+    saved = meta['Run']
+    if saved is None:
+        return schema, None
+
+    run = Run(schema, saved['Rank Type'], saved['Engine'],
+              saved['Log Level'], seed=saved['Seed'],
+              tiebreak=saved['Tiebreak'], objective=saved['Objective'])
+    run.stats.update(saved['Stats'])
+    run.random_tbs = saved['Random Tiebreaks']
+    run.tie_report = saved['Tie Report']
+    run.strict = load('lottery')
+    run.log.events = [(level, kind, data) for level, kind, data in saved['Log']]
+    analysts = {analyst.name: analyst for analyst in schema.analysts}
+    teams = {team.name: team for team in schema.teams}
+    run.random_tbs_data = [{'Winner': analysts[report['Winner']],
+                            'Loser': analysts[report['Loser']],
+                            'Team': teams[report['Team']],
+                            'Rank Type': report['Rank Type']}
+                           for report in saved['Tiebreaks']]
+    run.tied_ids = load('tied').tolist()
+    run.prefs_exhausted = dict(zip(compact.analyst_names,
+                                   load('exhausted').tolist()))
+    placed = load('placed')
+    team_sizes = load('team_sizes')
+    run.assigned = np.full(compact.n_analysts, -1, dtype=np.int32)
+    run.assigned[placed] = np.repeat(np.arange(compact.n_teams, dtype=np.int32),
+                                     team_sizes)
+    placed = placed.tolist()
+    bounds = np.cumsum(np.r_[0, team_sizes]).tolist()
+    run.placements = {team: [schema.analysts[a] for a in placed[start:end]]
+                      for team, start, end in zip(compact.team_names,
+                                                  bounds, bounds[1:])}
+    return schema, run
+
+def merge_placements(runs):
+    '''Combine the placements of runs over disjoint groups of analysts
+    (such as the tiers of Schema.run_tiers) into one {team_name: [Analyst]}.
+    '''
+    placements = {}
+    for run in runs:
+        for team, analysts in run.placements.items():
+            placements.setdefault(team, []).extend(analysts)
+    return placements
+
+def diff_placements(before, after):
+    '''Compare two placements (of Analysts or names) of the same cohort.
+    Returns a DataFrame of the analysts whose team differs, with their
+    Before and After team (None where an analyst is missing).
+    '''
+    def teams_of(placements):
+        return pd.Series({getattr(analyst, 'name', analyst): team
+                          for team, analysts in placements.items()
+                          for analyst in analysts}, dtype=object)
+    both = pd.DataFrame({'Before': teams_of(before), 'After': teams_of(after)})
+    both = both.astype(object).where(both.notna(), None)
+    moved = both[both['Before'] != both['After']]
+    return moved.rename_axis('Analyst').reset_index()
@@ -2,28 +2,99 @@ import streamlit as st
 import numpy as np
 import pandas as pd
 import base64
+import hashlib
+import threading
+from collections import OrderedDict
 from core import *
 
 '''
 # Upward Sorting Hat
 '''
 
+CACHE_SIZE = 8
+
+class LRUCache:
+    '''A small least-recently-used cache. Once it holds more than maxsize
+    entries, the least recently used one is evicted.
+
+    One cache is shared by every session, each on its own thread, so the
+    entries are only touched under a lock. Values are computed outside it,
+    under a lock per key: sessions asking for the same key wait for one
+    computation, and nobody else waits at all.
+    '''
+
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.key_locks = {}
+
+    def lookup(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return True, self.entries[key]
+            return False, None
+
+    def get(self, key, compute):
+        '''Return the cached value for key, calling compute() on a miss.'''
+        found, value = self.lookup(key)
+        if found:
+            return value
+        with self.lock:
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+        try:
+            with key_lock:
+                found, value = self.lookup(key)
+                if not found:
+                    value = compute()
+                    with self.lock:
+                        self.entries[key] = value
+                        if len(self.entries) > self.maxsize:
+                            self.entries.popitem(last=False)
+        finally:
+            with self.lock:
+                if self.key_locks.get(key) is key_lock:
+                    del self.key_locks[key]
+        return value
+
+#Streamlit re-runs this script on every interaction, so the caches have to
+#live in a resource Streamlit keeps for the life of the server process.
+if hasattr(st, 'cache_resource'):
+    keep_across_reruns = st.cache_resource
+else:
+    keep_across_reruns = st.cache(allow_output_mutation=True)
+
+@keep_across_reruns
+def get_caches():
+    return {'files': LRUCache(), 'runs': LRUCache()}
+
+def file_digest(file):
+    return hashlib.sha256(file.getvalue()).hexdigest()
+
 def read_file(file):
     try:
         df = pd.read_csv(file)
     except ValueError:
+        file.seek(0)
         df = pd.read_excel(file)
     return df
 
+def cached_read_file(file):
+    '''Parse an uploaded file once per distinct content. Returns the digest
+    of the file's bytes along with the DataFrame.
+    '''
+    digest = file_digest(file)
+    df = get_caches()['files'].get(digest, lambda: read_file(file))
+    return digest, df
+
 
-def map_perf(perf_string):
-    perf_map = {
-        'Low': 1,
-        'Meets': 2,
-        'Strong': 3,
-        'Top': 4
-    }
-    return perf_map[perf_string]
+PERF_LEVELS = {
+    'Low': 1,
+    'Meets': 2,
+    'Strong': 3,
+    'Top': 4
+}
 
 
 def get_table_download_link(df):
@@ -32,109 +103,132 @@ def get_table_download_link(df):
     href = f'<a download="robot_results.csv" href="data:file/csv;base64,{b64}">Download as a CSV.</a>'
     return href
 
+CHOICE_COLS = ['First Choice', 'Second Choice', 'Third Choice']
+
+SOLVERS = {
+    'Stable Matching': ('rounds', 'rank'),
+    'Fewest Preference Ranks': ('optimal', 'rank'),
+    'Best Team Ratings': ('optimal', 'rating'),
+}
+
 def generate_schema(analyst_df, team_df, rotation_type):
-    analyst_data = analyst_df.to_dict(orient='rows')
-    team_data = team_df.to_dict(orient='row')
+    '''Build the schema from the uploaded tables, in bulk. For final
+    placement there is no class, and the team columns after the headcount
+    are ratings: each is headed by a rating and lists the analysts given it.
+    '''
     if rotation_type == 'Rotation':
-        analysts = []
-        for row in analyst_data:
-            new_analyst = Analyst(name=row['Analyst Name'],
-                                  clas=int(row['Analyst Class'][-1]),
-                                  perf=map_perf(row['Analyst Performance']),
-                                  prefs={
-                                      row['First Choice']: 0,
-                                      row['Second Choice']: 1,
-                                      row['Third Choice']: 2
-                                  }
-                                  )
-            analysts.append(new_analyst)
-        teams = []
-        for row in team_data:
-            new_team = Team(name=row['Department Name'],
-                            headcount=row['Department Headcount'])
-            teams.append(new_team)
-        schema = Schema(analysts, teams)
-        return schema
+        class_col = 'Analyst Class'
+        rating_cols = None
     if rotation_type == 'Final':
-        analysts = []
-        for row in analyst_data:
-            new_analyst = Analyst(name=row['Analyst Name'],
-                                  clas=0,
-                                  perf=map_perf(row['Analyst Performance']),
-                                  prefs={
-                                      row['First Choice']: 0,
-                                      row['Second Choice']: 1,
-                                      row['Third Choice']: 2
-                                  }
-                                  )
-            analysts.append(new_analyst)
-        teams = []
-        for row in team_data:
-            df_cols = list(team_df.columns)
-            rating_cols = df_cols[2:]
-            ratings = {}
-            for col in rating_cols:
-                if isinstance(row[col], str):
-                    ratings[row[col]] = int(col)
-            new_team = Team(name=row['Department Name'],
-                            headcount=row['Department Headcount'],
-                            ratings=ratings)
-            teams.append(new_team)
-            schema = Schema(analysts, teams)
-        return schema
+        class_col = None
+        rating_cols = list(team_df.columns[2:])
+    return schema_from_frames(analyst_df, team_df, name_col='Analyst Name',
+                              class_col=class_col,
+                              perf_col='Analyst Performance',
+                              choice_cols=CHOICE_COLS,
+                              team_col='Department Name',
+                              headcount_col='Department Headcount',
+                              rating_cols=rating_cols, perf_map=PERF_LEVELS)
 
 rotation_type = st.selectbox('Choose Placement Type', ['Rotation', 'Final'])
+solver = st.selectbox('Choose Solver', list(SOLVERS))
 analyst_file = st.file_uploader('Upload Analyst Data', ['csv'])
 if analyst_file:
-    analyst_df = read_file(analyst_file)
+    analyst_digest, analyst_df = cached_read_file(analyst_file)
     st.write('### Analyst Data')
     st.write(analyst_df)
 
 team_file = st.file_uploader('Upload Team Data', ['csv'])
 if team_file:
-    team_df = read_file(team_file)
+    team_digest, team_df = cached_read_file(team_file)
     st.write('### Team Data')
     st.write(team_df)
 
+def run_placements(analyst_df, team_df, rotation_type, solver):
+    '''Build the schema and run the match, showing its progress as it goes.
+    Returns everything the page shows, already converted to names, so cached
+    runs are never mutated.
+    '''
+    schema = generate_schema(analyst_df, team_df, rotation_type)
+    ranktype = 'fulltime' if rotation_type == 'Final' else 'rotation'
+    engine, objective = SOLVERS[solver]
+    placement_run = Run(schema, ranktype, engine, objective=objective)
+    progress = st.empty()
+    log = []
+    for level, kind, data in schema.stream(placement_run):
+        log.append(dict(Event=kind, **data))
+        if kind == 'iteration':
+            progress.text('Iteration {Iteration}: {Unassigned} analysts '
+                          'still unassigned.'.format(**data))
+    progress.empty()
+    results = placement_run.results()
+    return {'schema': schema, 'results': results,
+            'summary': placement_run.summary(results),
+            'download_link': get_table_download_link(results),
+            'log': log, 'schema_json': schema.json(),
+            'stats': dict(placement_run.stats, Tiebreakers=placement_run.random_tbs),
+            'stability': placement_run.verify()}
+
+def show_summary(summary):
+    '''Summarize how well the analysts fared.'''
+    template = ('{:.0%} of analysts got their first choice and {:.0%} one of '
+                'their top three. A random tiebreak was involved for {:.0%}.')
+    st.write(template.format(summary['First Choice'], summary['Top Three'],
+                             summary['Tiebreak Share']))
+    st.write(summary['Teams'])
+
+def show_stats(stats):
+    '''Summarize how hard the algorithm had to work.'''
+    template = ('{Iterations} iterations, {Proposals} proposals, '
+                '{Comparisons} precedence comparisons and {Tiebreakers} '
+                'random tiebreaks.')
+    st.write(template.format(**stats))
+    if stats.get('Estimated Comparisons'):
+        st.write('Sorting the teams took about {} more comparisons.'.format(
+            stats['Estimated Comparisons']))
+    if 'Total Cost' in stats:
+        st.write('Total cost of the optimal assignment: {}.'.format(stats['Total Cost']))
+    if stats['Rejections']:
+        st.bar_chart(pd.Series(stats['Rejections'], name='Rejections'))
+    st.write(pd.Series(stats['Phase Seconds'], name='Seconds'))
+
 if team_file and analyst_file:
     # '''
     # If the data looks good, press the button below.
     # '''
     # run_algorithm = st.button('Run Algorithm')
     # if run_algorithm:
-    schema = generate_schema(analyst_df, team_df, rotation_type)
-    ranktype = 'fulltime' if rotation_type == 'Final' else 'rotation'
+    run_key = (analyst_digest, team_digest, rotation_type, solver)
+    run = get_caches()['runs'].get(run_key, lambda: run_placements(
+        analyst_df, team_df, rotation_type, solver))
     '''
     ## Placements
     Given the data you input, here's where the analysts all end up.
     '''
-    ## For dev
-    results = schema.set_placements(ranktype=ranktype)
-    results_df = []
-    for team in results.keys():
-        analysts = results[team]
-        analysts = [analyst.name for analyst in analysts]
-        results[team] = analysts
-        for analyst in analysts:
-            row = {'Team': team, 'Analyst': analyst}
-            results_df.append(row)
-    results_df = pd.DataFrame(results_df)
-    download_link = get_table_download_link(results_df)
-    st.write(results)
-    st.write(download_link, unsafe_allow_html=True)
+    st.write(run['results'])
+    st.write(run['download_link'], unsafe_allow_html=True)
+    show_summary(run['summary'])
     '''
     ## Algorithm Log
-    The log shows how the algorithm behaved, and where it placed analysts in
-    each iteration, until it finally converged.
+    The log shows how the algorithm behaved: which analysts each team
+    rejected in each iteration, until it finally converged.
     '''
 
-    log = schema.log
-    for iteration in log.keys():
-        if 'Unassigned Analysts' in log[iteration].keys():
-            analysts = log[iteration]['Unassigned Analysts']
-            analysts = [analyst.name for analyst in analysts]
-            log[iteration]['Unassigned Analysts'] = analysts
-    st.json(log)
+    st.json(run['log'])
+    '''
+    ## Run Statistics
+    Many iterations or proposals per analyst, or one team rejecting most of
+    the cohort, mean the cohort is pathological (everybody wanting the same
+    team, say).
+    '''
+    show_stats(run['stats'])
+    stability = run['stability']
+    if stability['Stable']:
+        st.write('The placements are stable: no analyst and team would both '
+                 'rather be together.')
+    else:
+        st.write('The placements are **not** stable:')
+        st.write(stability['Blocking Pairs'])
     '## Schema'
     'The "schema" displays how the program interpreted the data.'
-    st.write(schema.json())
+    st.write(run['schema_json'])
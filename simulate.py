@@ -0,0 +1,171 @@
+'''
+Monte Carlo simulation of the placement algorithm, for policy analysis.
+
+Runs many independent random_schema + Schema.run trials across a
+process pool and aggregates them as they finish into distributions: which
+choice analysts received, iteration counts, how often random tiebreaks
+fire, and outcomes per class and performance rating. Only the running
+aggregates are kept, so memory does not grow with the number of trials.
+
+    python simulate.py --trials 5000 --analysts 40 --teams 10 --extra 5
+'''
+from core import *
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import argparse
+import json
+import os
+
+
+def run_trial(seed, n_analysts, n_teams, extra_spots, ranktype, engine,
+              tiebreak='pairwise'):
+    '''Run one trial with its own seed and return a small summary of it.
+    Ranks are the analyst's own preference rank of the team they got
+    (0 is their first choice).
+    '''
+    schema = random_schema(n_analysts, n_teams, extra_spots, seed=seed)
+    try:
+        run = schema.run(ranktype, engine=engine, log_level=LOG_OFF, seed=seed,
+                         tiebreak=tiebreak)
+    except Exception as e:
+        return {'Error': str(e)}
+    ranks = Counter()
+    class_ranks = Counter()
+    perf_ranks = Counter()
+    for team_name, analysts in run.placements.items():
+        for analyst in analysts:
+            rank = analyst.prefs[team_name]
+            ranks[rank] += 1
+            class_ranks[(analyst.clas, rank)] += 1
+            perf_ranks[(analyst.perf, rank)] += 1
+    return {'Ranks': ranks, 'Class Ranks': class_ranks,
+            'Perf Ranks': perf_ranks, 'Tiebreakers': run.random_tbs,
+            'Iterations': run.stats['Iterations'],
+            'Proposals': run.stats['Proposals']}
+
+
+class Summary:
+    '''Streaming aggregate of trial results.'''
+
+    def __init__(self):
+        self.trials = 0
+        self.failures = Counter()
+        self.ranks = Counter()
+        self.class_ranks = Counter()
+        self.perf_ranks = Counter()
+        self.iterations = Counter()
+        self.tiebreakers = Counter()
+        self.proposals = 0
+
+    def add(self, trial):
+        self.trials += 1
+        if 'Error' in trial:
+            self.failures[trial['Error']] += 1
+            return
+        self.ranks.update(trial['Ranks'])
+        self.class_ranks.update(trial['Class Ranks'])
+        self.perf_ranks.update(trial['Perf Ranks'])
+        self.iterations[trial['Iterations']] += 1
+        self.tiebreakers[trial['Tiebreakers']] += 1
+        self.proposals += trial['Proposals']
+
+    @staticmethod
+    def shares(counter):
+        total = sum(counter.values())
+        return {rank: count / total for rank, count in sorted(counter.items())}
+
+    @staticmethod
+    def grouped_shares(counter):
+        groups = {}
+        for (group, rank), count in counter.items():
+            groups.setdefault(group, Counter())[rank] += count
+        return {group: Summary.shares(ranks) for group, ranks in sorted(groups.items())}
+
+    def json(self):
+        completed = self.trials - sum(self.failures.values())
+        with_tiebreaks = completed - self.tiebreakers.get(0, 0)
+        total_tiebreaks = sum(n * count for n, count in self.tiebreakers.items())
+        return {
+            'Trials': self.trials,
+            'Failures': dict(self.failures),
+            'Rank Shares': self.shares(self.ranks),
+            'Rank Shares by Class': self.grouped_shares(self.class_ranks),
+            'Rank Shares by Performance': self.grouped_shares(self.perf_ranks),
+            'Iterations': dict(sorted(self.iterations.items())),
+            'Trials with Tiebreakers': with_tiebreaks / completed if completed else None,
+            'Mean Tiebreakers': total_tiebreaks / completed if completed else None,
+            'Mean Proposals': self.proposals / completed if completed else None,
+        }
+
+
+def trial_seeds(seed, n_trials):
+    '''One independent seed per trial, so results do not depend on which
+    worker runs which trial. Each is derived as it is needed, so memory does
+    not grow with n_trials; they are the seeds SeedSequence(seed).spawn
+    would give.
+    '''
+    for i in range(n_trials):
+        child = np.random.SeedSequence(seed, spawn_key=(i,))
+        yield int(child.generate_state(1)[0])
+
+
+def simulate(n_trials, n_analysts, n_teams, extra_spots, ranktype='rotation',
+             engine='rounds', workers=None, seed=0, tiebreak='pairwise'):
+    '''Run n_trials trials and return their Summary.
+    workers: (int) Size of the process pool. 1 runs the trials in this
+        process. Defaults to the number of CPUs.
+    seed: (int) Seed for the whole simulation.
+    tiebreak: (str) See Run. With a lottery, Tiebreakers counts the
+        rejections the lottery decided rather than pairwise coin flips.
+    '''
+    args = (n_analysts, n_teams, extra_spots, ranktype, engine, tiebreak)
+    summary = Summary()
+    seeds = trial_seeds(seed, n_trials)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for trial_seed in seeds:
+            summary.add(run_trial(trial_seed, *args))
+        return summary
+
+    #Bound the number of trials in flight so memory stays flat.
+    max_pending = workers * 4
+    with ProcessPoolExecutor(workers) as pool:
+        pending = set()
+        for trial_seed in seeds:
+            pending.add(pool.submit(run_trial, trial_seed, *args))
+            if len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    summary.add(future.result())
+        for future in pending:
+            summary.add(future.result())
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Monte Carlo simulation of the placement algorithm.')
+    parser.add_argument('--trials', type=int, default=1000)
+    parser.add_argument('--analysts', type=int, default=40)
+    parser.add_argument('--teams', type=int, default=10)
+    parser.add_argument('--extra', type=int, default=0)
+    parser.add_argument('--ranktype', default='rotation', choices=RANK_TYPES)
+    parser.add_argument('--engine', default='rounds', choices=ENGINES,
+                        help='Iteration counts are only meaningful for rounds.')
+    parser.add_argument('--tiebreak', default='pairwise', choices=TIEBREAKS)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default=None, help='Write the summary as JSON.')
+    args = parser.parse_args(argv)
+
+    summary = simulate(args.trials, args.analysts, args.teams, args.extra,
+                       args.ranktype, args.engine, args.workers, args.seed,
+                       args.tiebreak)
+    report = json.dumps(summary.json(), indent=1)
+    if args.out:
+        with open(args.out, 'w') as file:
+            file.write(report)
+    print(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+'''
+Checks of core.py that need neither Streamlit nor the nltk names corpus:
+cohorts are built straight from arrays. Run with python -m pytest.
+'''
+from core import *
+import pickle
+import pytest
+
+
+def tie_free_cohort(rng, n_analysts, n_teams):
+    '''A random CompactSchema where no two analysts are ever tied: every
+    performance rating is distinct. Every team is ranked by every analyst
+    and rates every analyst 1 to 3, so both rank types can place everyone.
+    '''
+    prefs = np.argsort(rng.random((n_analysts, n_teams)), axis=1)
+    headcount = rng.multinomial(n_analysts + rng.integers(0, 4),
+                                np.ones(n_teams) / n_teams)
+    return CompactSchema(['A{}'.format(a) for a in range(n_analysts)],
+                         ['T{}'.format(t) for t in range(n_teams)],
+                         rng.integers(1, 4, n_analysts),
+                         rng.permutation(n_analysts), prefs, headcount,
+                         rng.integers(1, 4, (n_teams, n_analysts)))
+
+
+def random_edits(rng, compact):
+    analyst_names = compact.analyst_names
+    team_names = compact.team_names
+    edits = []
+    kind = rng.choice(['add', 'remove', 'prefs', 'raise', 'lower', 'rating'])
+    if kind == 'add':
+        order = rng.permutation(compact.n_teams)
+        analyst = Analyst('New', int(rng.integers(1, 4)), -1,
+                          {team_names[t]: i for i, t in enumerate(order)})
+        edits.append(('add', analyst))
+        for team in team_names:
+            edits.append(('rating', team, 'New', int(rng.integers(1, 4))))
+    elif kind == 'remove':
+        edits.append(('remove', rng.choice(analyst_names)))
+    elif kind == 'prefs':
+        order = rng.permutation(compact.n_teams)
+        edits.append(('prefs', rng.choice(analyst_names),
+                      {team_names[t]: i for i, t in enumerate(order)}))
+    elif kind in ('raise', 'lower'):
+        t = int(rng.integers(compact.n_teams))
+        change = 1 if kind == 'raise' else -1
+        edits.append(('headcount', team_names[t],
+                      max(0, int(compact.headcount[t]) + change)))
+    else:
+        edits.append(('rating', rng.choice(team_names),
+                      rng.choice(analyst_names), int(rng.integers(1, 4))))
+    return edits
+
+
+def placed_on(placements):
+    return {analyst.name: team for team, analysts in placements.items()
+            for analyst in analysts}
+
+
+@pytest.mark.parametrize('ranktype', RANK_TYPES)
+def test_rematch_matches_full_run(ranktype):
+    rng = np.random.default_rng(11)
+    checked = 0
+    for _ in range(400):
+        compact = tie_free_cohort(rng, int(rng.integers(4, 30)),
+                                  int(rng.integers(2, 8)))
+        schema = Schema.from_compact(compact)
+        edits = random_edits(rng, compact)
+        try:
+            run = schema.run(ranktype, engine='heap', log_level=LOG_OFF)
+            full = Schema.from_compact(compact.edit(edits)[0]).run(
+                ranktype, engine='heap', log_level=LOG_OFF)
+        except Exception:
+            continue #Not enough headcount for everyone.
+        _, repaired = schema.rematch(run.placements, ranktype, edits)
+        assert placed_on(repaired.placements) == placed_on(full.placements), edits
+        checked += 1
+    assert checked > 200
+
+
+@pytest.mark.parametrize('tiebreak', ['single', 'multiple'])
+def test_rematch_matches_full_lottery_run(tiebreak):
+    rng = np.random.default_rng(12)
+    for seed in range(100):
+        compact = tie_free_cohort(rng, int(rng.integers(4, 30)),
+                                  int(rng.integers(2, 8)))
+        #Only three performance ratings, so there are ties to break.
+        compact.perf[:] = compact.perf % 3
+        schema = Schema.from_compact(compact)
+        edits = random_edits(rng, compact)
+        try:
+            run = schema.run('rotation', engine='heap', log_level=LOG_OFF,
+                             seed=seed, tiebreak=tiebreak)
+            full = Schema.from_compact(compact.edit(edits)[0]).run(
+                'rotation', engine='heap', log_level=LOG_OFF, seed=seed,
+                tiebreak=tiebreak)
+        except Exception:
+            continue
+        _, repaired = schema.rematch(run.placements, 'rotation', edits,
+                                     seed=seed, tiebreak=tiebreak)
+        assert placed_on(repaired.placements) == placed_on(full.placements), edits
+
+
+def test_view_schema_pickles():
+    schema = Schema.from_compact(tie_free_cohort(np.random.default_rng(3), 30, 5))
+    copy = pickle.loads(pickle.dumps(schema))
+    assert [analyst.name for analyst in copy.analysts] == \
+           [analyst.name for analyst in schema.analysts]
+    run = schema.run('rotation', log_level=LOG_OFF)
+    assert placed_on(copy.run('rotation', log_level=LOG_OFF).placements) == \
+           placed_on(run.placements)
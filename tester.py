@@ -1,4 +1,5 @@
 import streamlit as st
+import io
 from core import *
 
 st.header('Upward Algorithm Tester')
@@ -6,13 +7,16 @@ st.header('Upward Algorithm Tester')
 This dashboard generates explores the Upward Placement Algorithm by generating
 a random set of analysts and teams and showing where the algorithm places them.
 
-Currently, it only simulates inter-rotational placement. A future version will
-simulate full-time placement and multi-tiered placement as well.
+It simulates inter-rotational placement, or a multi-tiered placement in which
+class 3 is placed full-time first and the other classes then rotate into the
+headcount that is left.
 '''
 st.sidebar.subheader('Random Data Parameters')
 n_analysts = st.sidebar.slider('Number of Analysts', 1, 40)
 n_teams = st.sidebar.slider('Number of Teams', 1, 15)
 extra_spots = st.sidebar.slider('Extra Headcount', 0, 20)
+profile = st.sidebar.checkbox('Profile the Run')
+placement = st.sidebar.selectbox('Placement', ['Rotation', 'Class 3 Fulltime, then Rotation'])
 
 rand_schema = random_schema(n_analysts, n_teams, extra_spots)
 
@@ -20,20 +24,40 @@ st.subheader('Schema')
 st.json(rand_schema.json())
 
 st.subheader('Algorithm Results')
-results = rand_schema.set_placements(noisy=False)
-for team in results.keys():
-    analysts = results[team]
-    analysts = [analyst.name for analyst in analysts]
-    results[team] = analysts
+if placement != 'Rotation':
+    for (ranktype, classes), run in rand_schema.run_tiers(
+            [('fulltime', [3]), ('rotation', None)], log_level=LOG_SUMMARY):
+        st.write('**{}** placement of {} analysts.'.format(
+            ranktype.capitalize(), run.schema.n_analysts))
+        st.write('{} random tiebreaks.'.format(run.random_tbs))
+        st.json(run.stats)
+        st.write(run.results())
+        st.write(run.summary()['Teams'])
+    st.stop()
 
-st.json(results)
+run = Run(rand_schema, 'rotation', profile=profile_cpu if profile else None)
+progress = st.empty()
+log = []
+for level, kind, data in rand_schema.stream(run):
+    log.append(dict(Event=kind, **data))
+    if kind == 'iteration':
+        progress.text('Iteration {Iteration}: {Unassigned} analysts '
+                      'still unassigned.'.format(**data))
+progress.empty()
+results = run.results()
+st.write(results)
+summary = run.summary(results)
+st.write('{:.0%} of analysts got their first choice.'.format(summary['First Choice']))
+st.write(summary['Teams'])
 
 st.subheader('Algorithm Log')
-log = rand_schema.log
-for iteration in log.keys():
-    if 'Unassigned Analysts' in log[iteration].keys():
-        analysts = log[iteration]['Unassigned Analysts']
-        analysts = [analyst.name for analyst in analysts]
-        log[iteration]['Unassigned Analysts'] = analysts
 st.json(log)
-#st.write(rand_schema.log_txt)
+
+st.subheader('Run Statistics')
+st.write('{} random tiebreaks.'.format(run.random_tbs))
+st.json(run.stats)
+if profile:
+    buffer = io.StringIO()
+    run.profile.stream = buffer
+    run.profile.sort_stats('cumulative').print_stats(20)
+    st.text(buffer.getvalue())
@@ -1,5 +1,25 @@
 from core import *
 
+def run_to_file(schema, ranktype, log_fp='Upward_Placements_Log.txt',
+                keep_log=False, **kwargs):
+    '''Place the analysts, writing the algorithm log to log_fp as it runs
+    rather than keeping it in memory (unless keep_log, e.g. to snapshot the
+    run afterwards). kwargs are passed on to Run. Returns the finished Run.
+    '''
+    run = Run(schema, ranktype, **kwargs)
+    kept = []
+    with open(log_fp, 'w') as file:
+        for event in schema.stream(run):
+            file.write(EventLog.render_event(event) + '\n')
+            if keep_log:
+                kept.append(event)
+    run.log.events = kept
+    return run
+
+def write_placements(run, csv_fp='Upward_Placements.csv'):
+    '''Write a run's placements as a CSV: the table of Run.results.'''
+    run.results().to_csv(csv_fp, index=False)
+
 if __name__ == '__main__':
     fp = input('\nEnter Excel file path:\n')
     analyst_sheet = input('\nEnter analyst sheet:\n')
@@ -14,17 +34,6 @@ if __name__ == '__main__':
     else:
         print('Not ready for that yet. Chill!')
 
-    placements = schema.set_placements(noisy=True)
-
-    placements_dicts = []
-    for team in placements.keys():
-        analysts = placements[team]
-        for analyst in analysts:
-            mini_dict = {'Analyst': analyst.name, 'Team': team}
-            placements_dicts.append(mini_dict)
-
-    placements_df = pd.DataFrame(placements_dicts)
-    placements_df.to_csv('Upward_Placements.csv', index=False)
-    log_fp = 'Upward_Placements_Log.txt'
-    with open(log_fp, 'w') as file:
-        file.write(schema.log_txt)
+    run = run_to_file(schema, 'rotation', keep_log=True, noisy=True)
+    write_placements(run)
+    save_snapshot('Upward_Snapshot', schema, run)